@@ -1,4 +1,8 @@
 import streamlit as st
+from building_blocks.core import preload_models
+
+# Load the model once per server process before the first extraction is requested, without blocking the pages
+preload_models(["./model"])
 
 main_page = st.Page("app_views/app.py")
 view_page = st.Page("app_views/view_page.py")
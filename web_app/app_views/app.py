@@ -38,6 +38,9 @@ with main_container:
         args=["main_activity_selector"]
     )
 
+    # Progress of the running extractions, shown on every tab
+    blocks.render_extraction_jobs()
+
     if not menubar_segment:
         note = '''
         **Manage**: See all uploaded PDF Files. Processed files after extraction appear here as well. You can remove files if not required from this tab.
@@ -65,7 +68,7 @@ with main_container:
 
         st.write('''
         Select the PDF files by clicking the toggle button.
-        For Each selected file, **write the Page no. where the modules begin in the PDF**.
+        For Each selected file, you can write the Page no. where the modules begin in the PDF. **If left empty, the module pages are detected automatically.**
         After selecting the files, click on Extract to start the process.
         ''')
 
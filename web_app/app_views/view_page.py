@@ -24,6 +24,11 @@ if "requested_file_for_viewing" in st.session_state:
 if file_to_view:
     st.write(f"You are now viewing the extracted data from :red[{file_to_view["name"]}]")
     st.write(file_to_view["extractions"])
+
+    # Durations, counts and memory of the extraction
+    if file_to_view["name"] in st.session_state.get("extraction_metrics", {}):
+        with st.expander("Extraction metrics"):
+            st.json(st.session_state["extraction_metrics"][file_to_view["name"]])
 else:
     st.markdown("⚠️ Requested File cannot be found anymore. If has been removed, you will need to re-upload and extract the file.")
 
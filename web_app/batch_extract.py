@@ -0,0 +1,215 @@
+# Runs the extraction pipeline (ModelInteractor -> PostProcess) without the web-app over whole folders of module handbooks.
+# Every worker process loads the model once. Results are appended to a JSONL file, one line per handbook,
+# so an interrupted run continues where it stopped when started again with the same output file.
+#
+# Example: python batch_extract.py ../dataset/stage_one --start-page 3 --workers 2 --output results.jsonl
+# Example: python batch_extract.py handbooks.csv --workers 4 --output results.jsonl
+#
+# A manifest is a CSV file with the columns `path` and `start_page`. Relative paths are relative to the manifest.
+# Without a start page, the module pages are detected automatically.
+
+import os
+import io
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Options of the worker process, set once by `_init_worker`
+_worker_options = None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract modules from a folder or manifest of PDF handbooks.")
+    parser.add_argument("input", help="Folder of PDF files or CSV manifest with the columns path and start_page")
+    parser.add_argument("--output", default="extractions.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--start-page", type=int, default=None, help="Module start page for all PDFs of a folder. Detected automatically if not given")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each with its own copy of the model")
+    parser.add_argument("--model-dir", default="./model", help="Folder of the fine-tuned model")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--quantize", action="store_true", help="Use the dynamic int8 quantized model")
+    parser.add_argument("--backend", default="eager", choices=["eager", "compile", "torchscript", "onnx"])
+    parser.add_argument("--strip-boilerplate", action="store_true", help="Remove running headers, footers and page numbers before tokenization")
+    parser.add_argument("--parse-known-layouts", action="store_true", help="Read the module tables of known handbook layouts with rules and run the model only on the rest")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "auto"], help="bf16 runs the forward pass under bf16 autocast on hardware with native bf16 support")
+    parser.add_argument("--cascade-model-dir", default=None, help="Larger model with the same tokenizer which predicts the uncertain chunks again")
+    parser.add_argument("--cascade-threshold", type=float, default=0.9, help="Tokens with a lower confidence are uncertain")
+    parser.add_argument("--cascade-max-uncertain", type=float, default=0.01, help="Fraction of uncertain tokens a chunk may have before it is escalated")
+    return parser.parse_args()
+
+def read_jobs(input_path:str, start_page:int=None) -> list:
+
+    """
+    Returns the list of `(pdf_path, module_start_page)` jobs of a folder or a CSV manifest.
+    """
+
+    jobs = []
+
+    if os.path.isdir(input_path):
+        for file_name in sorted(os.listdir(input_path)):
+            if file_name.lower().endswith(".pdf"):
+                jobs.append((os.path.join(input_path, file_name), start_page))
+        return jobs
+
+    manifest_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path, "r", encoding="utf-8", newline="") as manifest_file:
+        for row in csv.DictReader(manifest_file):
+            pdf_path = row["path"] if os.path.isabs(row["path"]) else os.path.join(manifest_dir, row["path"])
+            jobs.append((pdf_path, int(row["start_page"]) if row.get("start_page") else start_page))
+
+    return jobs
+
+def get_path_key(pdf_path:str) -> str:
+
+    # The same handbook can be given as ./x.pdf, x.pdf or through a manifest
+    return os.path.normcase(os.path.realpath(pdf_path))
+
+def read_finished(output_path:str) -> set:
+
+    """
+    Returns the resolved paths (see `get_path_key`) of the PDF files which already have a successful result in the output file.
+    """
+
+    finished = set()
+    if not os.path.isfile(output_path):
+        return finished
+
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a crashed run
+                continue
+            if "error" not in record:
+                finished.add(get_path_key(record["path"]))
+
+    return finished
+
+def end_partial_line(output_path:str) -> None:
+
+    """
+    Terminates the last line of the output file if a crashed run left it without a newline,
+    so the next record is not appended to it.
+    """
+
+    if not os.path.isfile(output_path) or os.path.getsize(output_path) == 0:
+        return
+
+    with open(output_path, "rb+") as output_file:
+        output_file.seek(-1, os.SEEK_END)
+        if output_file.read(1) != b"\n":
+            output_file.write(b"\n")
+
+def _init_worker(options:dict) -> None:
+
+    # Runs once in every worker process: split the CPU threads and load the model
+    global _worker_options
+    _worker_options = options
+
+    import torch
+    from model_handler.model_registry import model_registry
+    from model_handler.backends import resolve_precision
+
+    torch.set_num_threads(options["num_threads"])
+
+    # Resolved once per worker, so a bf16 fallback is reported once and not for every handbook
+    options["precision"] = resolve_precision(options["precision"], options["quantize"], options["backend"])
+    model_registry.get(options["model_dir"], quantize=options["quantize"], backend=options["backend"], precision=options["precision"])
+    if options["cascade_model_dir"]:
+        model_registry.get(options["cascade_model_dir"], quantize=options["quantize"], backend=options["backend"], precision=options["precision"])
+
+def extract_file(pdf_path:str, module_start_page:int) -> dict:
+
+    """
+    Runs the extraction pipeline on one PDF file and returns its JSONL record.
+    """
+
+    from model_handler.inferencing import ModelInteractor
+    from model_handler.postprocessing import PostProcess
+
+    options = _worker_options
+    start_time = time.perf_counter()
+
+    record = {}
+    record["path"] = pdf_path
+    record["module_start_page"] = module_start_page
+
+    try:
+        with open(pdf_path, "rb") as pdf_file:
+            file_object = io.BytesIO(pdf_file.read())
+        file_object.name = os.path.basename(pdf_path)
+
+        # Workers already run in parallel, so they read their PDF in a single process
+        me = ModelInteractor(file_object, module_start_page, model_dir=options["model_dir"], batch_size=options["batch_size"], quantize=options["quantize"], backend=options["backend"], precision=options["precision"], strip_boilerplate=options["strip_boilerplate"], parse_known_layouts=options["parse_known_layouts"], extraction_workers=1, cascade_model_dir=options["cascade_model_dir"], cascade_threshold=options["cascade_threshold"], cascade_max_uncertain=options["cascade_max_uncertain"])
+        text_object = me.extract_text_from_pdf()
+        results = me.make_predictions(text_object)
+
+        pp = PostProcess(results)
+        pp.join_subwords_and_labels()
+        extracted_file = pp.group_words_to_labels()
+
+        record["name"] = extracted_file["name"]
+        record["extractions"] = list(me.add_rule_extractions(extracted_file["extractions"]))
+    except Exception as error:
+        record["error"] = f"{type(error).__name__}: {error}"
+
+    record["seconds"] = round(time.perf_counter() - start_time, 3)
+
+    return record
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    jobs = read_jobs(args.input, args.start_page)
+    finished = read_finished(args.output)
+
+    # Handbooks which are done or listed twice are skipped
+    pending_jobs = []
+    for pdf_path, module_start_page in jobs:
+        path_key = get_path_key(pdf_path)
+        if path_key not in finished:
+            pending_jobs.append((pdf_path, module_start_page))
+            finished.add(path_key)
+    print(f"----- {len(pending_jobs)} OF {len(jobs)} HANDBOOKS TO EXTRACT ({len(jobs) - len(pending_jobs)} ALREADY DONE OR LISTED TWICE) -----")
+
+    options = {}
+    options["model_dir"] = args.model_dir
+    options["batch_size"] = args.batch_size
+    options["quantize"] = args.quantize
+    options["backend"] = args.backend
+    options["precision"] = args.precision
+    options["strip_boilerplate"] = args.strip_boilerplate
+    options["parse_known_layouts"] = args.parse_known_layouts
+    options["cascade_model_dir"] = args.cascade_model_dir
+    options["cascade_threshold"] = args.cascade_threshold
+    options["cascade_max_uncertain"] = args.cascade_max_uncertain
+    options["num_threads"] = max((os.cpu_count() or 1) // max(args.workers, 1), 1)
+
+    num_failed = 0
+    end_partial_line(args.output)
+    with open(args.output, "a", encoding="utf-8") as output_file:
+
+        def write_record(record:dict) -> None:
+            # One flushed line per handbook, so a crash loses at most the handbooks in progress
+            output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output_file.flush()
+            status = f"FAILED ({record['error']})" if "error" in record else f"{len(record['extractions'])} chunks"
+            print(f"{record['path']}: {status} in {record['seconds']}s")
+
+        if args.workers <= 1:
+            _init_worker(options)
+            for pdf_path, module_start_page in pending_jobs:
+                record = extract_file(pdf_path, module_start_page)
+                num_failed += "error" in record
+                write_record(record)
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(options,)) as pool:
+                futures = [pool.submit(extract_file, pdf_path, module_start_page) for pdf_path, module_start_page in pending_jobs]
+                for future in as_completed(futures):
+                    record = future.result()
+                    num_failed += "error" in record
+                    write_record(record)
+
+    print(f"----- DONE. {num_failed} HANDBOOKS FAILED -----")
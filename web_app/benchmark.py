@@ -0,0 +1,232 @@
+# End-to-end benchmark of the extraction pipeline on the module handbooks in ../dataset/stage_one.
+# Reports pages/s, tokens/s, the wall time of every stage, the peak memory and the chunk counts.
+# Save the report as JSON and diff it between commits to catch performance regressions before deploying.
+#
+# Example: python benchmark.py --threads 4 --batch-size 8 --output benchmark.json
+
+import os
+import io
+import json
+import time
+import glob
+import argparse
+import platform
+import subprocess
+import statistics
+import torch
+from model_handler.model_registry import model_registry
+from model_handler.backends import resolve_precision
+from model_handler.inferencing import ModelInteractor
+from model_handler.postprocessing import PostProcess
+from model_handler.instrumentation import Tracer, get_peak_rss_mb
+
+STAGES = ["read", "tokenize", "predict", "postprocess"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline on the stage-one handbooks.")
+    parser.add_argument("--pdf-dir", default="../dataset/stage_one", help="Folder of the PDF handbooks")
+    parser.add_argument("--model-dir", default="./model", help="Folder of the fine-tuned model")
+    parser.add_argument("--threads", type=int, default=None, help="Number of torch CPU threads")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--quantize", action="store_true", help="Benchmark the dynamic int8 quantized model")
+    parser.add_argument("--backend", default="eager", choices=["eager", "compile", "torchscript", "onnx"])
+    parser.add_argument("--strip-boilerplate", action="store_true", help="Remove running headers, footers and page numbers before tokenization")
+    parser.add_argument("--parse-known-layouts", action="store_true", help="Read the module tables of known handbook layouts with rules and run the model only on the rest")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "auto"], help="bf16 runs the forward pass under bf16 autocast on hardware with native bf16 support")
+    parser.add_argument("--cache-pages", action="store_true", help="Reuse the predictions of chunks which were predicted before (repeated runs then hit the page cache)")
+    parser.add_argument("--start-page", type=int, default=None, help="Module start page for all PDFs. Detected automatically if not given")
+    parser.add_argument("--max-pages", type=int, default=None, help="Only run the model on the first N (module) pages of every PDF")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per PDF. The median run is reported")
+    parser.add_argument("--cascade-model-dir", default=None, help="Larger model for the uncertain chunks of --model-dir. Also benchmarks this model alone for the speedup")
+    parser.add_argument("--cascade-threshold", type=float, default=0.9, help="Tokens with a lower confidence are uncertain")
+    parser.add_argument("--cascade-max-uncertain", type=float, default=0.01, help="Fraction of uncertain tokens a chunk may have before it is escalated")
+    parser.add_argument("--output", default=None, help="Optional path to save the report as JSON")
+    parser.add_argument("--profile-dir", default=None, help="Optional folder for torch profiler traces of the predict stage")
+    return parser.parse_args()
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark_file(pdf_path:str, args, model_dir:str=None, cascade_model_dir:str=None) -> dict:
+
+    """
+    Runs the pipeline once on a PDF file and returns the timings and counts of this run.
+
+    `model_dir` and `cascade_model_dir` override the models of `args`. Used to benchmark the cascade model alone.
+    """
+
+    with open(pdf_path, "rb") as pdf_file:
+        file_object = io.BytesIO(pdf_file.read())
+    file_object.name = os.path.basename(pdf_path)
+
+    # Unless asked for, the page cache is off, as it would turn repeated runs into cache hits
+    tracer = Tracer(file_object.name, profile_dir=args.profile_dir)
+    me = ModelInteractor(file_object, args.start_page, model_dir=model_dir or args.model_dir, batch_size=args.batch_size, quantize=args.quantize, backend=args.backend, precision=args.precision, strip_boilerplate=args.strip_boilerplate, parse_known_layouts=args.parse_known_layouts, cascade_model_dir=cascade_model_dir, cascade_threshold=args.cascade_threshold, cascade_max_uncertain=args.cascade_max_uncertain, cache_pages=args.cache_pages, tracer=tracer)
+
+    with tracer.span("read"):
+        text_object = me.extract_text_from_pdf()
+        if args.max_pages:
+            text_object["content"] = text_object["content"][:args.max_pages]
+
+    with tracer.span("tokenize_all"):
+        prepared_chunks = me.prepare_predictions(text_object)
+
+    with tracer.span("predict"):
+        results = me.make_predictions(text_object, prepared_chunks)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    with tracer.span("postprocess"):
+        pp = PostProcess(results, tracer=tracer)
+        pp.join_subwords_and_labels()
+        extracted_file = pp.group_words_to_labels()
+        extracted_file["extractions"] = list(me.add_rule_extractions(extracted_file["extractions"]))
+
+    summary = tracer.summary()
+
+    # Stage timings of the benchmark, and the finer spans recorded inside the pipeline
+    run = {}
+    run["seconds"] = {}
+    run["seconds"]["read"] = summary["stages"]["read"]["seconds"]
+    run["seconds"]["tokenize"] = summary["stages"]["tokenize_all"]["seconds"]
+    run["seconds"]["predict"] = summary["stages"]["predict"]["seconds"]
+    run["seconds"]["postprocess"] = summary["stages"]["postprocess"]["seconds"]
+    run["seconds"]["total"] = sum(run["seconds"][stage] for stage in STAGES)
+    run["spans"] = {stage: round(seconds, 4) for stage, seconds in tracer.get_stage_seconds().items()}
+    run["counters"] = summary["counters"]
+    # Pages parsed from their tables without any text left for the model are done as well
+    run["pages"] = len(text_object["content"]) + me.layout_stats.get("pages_parsed", 0) - me.layout_stats.get("pages_with_residual_text", 0)
+    run["chunks"] = len(prepared_chunks["input_ids"])
+    run["tokens"] = sum(len(chunk) for chunk in prepared_chunks["input_ids"])
+    run["extractions"] = len(extracted_file["extractions"])
+    if me.cascade_stats:
+        run["cascade"] = me.cascade_stats
+    if me.layout_stats:
+        run["layout"] = me.layout_stats
+
+    return run
+
+def summarize(runs:list) -> dict:
+
+    # Median run by total time
+    runs = sorted(runs, key=lambda run: run["seconds"]["total"])
+    summary = runs[len(runs) // 2]
+    summary["pages_per_second"] = summary["pages"] / summary["seconds"]["total"]
+    summary["tokens_per_second"] = summary["tokens"] / summary["seconds"]["predict"] if summary["seconds"]["predict"] else 0.0
+
+    return summary
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.pdf_dir, "*.pdf")))
+    if not pdf_paths:
+        raise SystemExit(f"No PDF files found in {args.pdf_dir}")
+
+    report = {}
+    report["environment"] = {
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "device": "cuda" if torch.cuda.is_available() and not args.quantize and args.backend != "onnx" else "cpu",
+        "cpu_count": os.cpu_count(),
+        "threads": torch.get_num_threads()
+    }
+    report["settings"] = {
+        "model_dir": args.model_dir,
+        "batch_size": args.batch_size,
+        "quantize": args.quantize,
+        "backend": args.backend,
+        "precision": args.precision,
+        "strip_boilerplate": args.strip_boilerplate,
+        "cache_pages": args.cache_pages,
+        "parse_known_layouts": args.parse_known_layouts,
+        "start_page": args.start_page,
+        "max_pages": args.max_pages,
+        "repeat": args.repeat,
+        "profile_dir": args.profile_dir,
+        "cascade_model_dir": args.cascade_model_dir,
+        "cascade_threshold": args.cascade_threshold,
+        "cascade_max_uncertain": args.cascade_max_uncertain
+    }
+
+    # Resolved once, so a bf16 fallback is reported once and not for every file
+    args.precision = resolve_precision(args.precision, args.quantize, args.backend)
+
+    # Loading the model is measured on its own and not part of the per-file timings
+    print("----- LOADING MODEL -----")
+    start_time = time.perf_counter()
+    loaded_model = model_registry.get(args.model_dir, quantize=args.quantize, backend=args.backend, precision=args.precision)
+    report["model_load_seconds"] = time.perf_counter() - start_time
+    report["settings"]["resolved_precision"] = "int8" if args.quantize else loaded_model.precision
+    if args.cascade_model_dir:
+        model_registry.get(args.cascade_model_dir, quantize=args.quantize, backend=args.backend, precision=args.precision)
+
+    # The first forward passes are slower (allocations, kernel selection), so they are not measured
+    print("----- WARMING UP -----")
+    benchmark_file(pdf_paths[0], args, cascade_model_dir=args.cascade_model_dir)
+    if args.cascade_model_dir:
+        benchmark_file(pdf_paths[0], args, model_dir=args.cascade_model_dir)
+
+    report["files"] = {}
+    for pdf_path in pdf_paths:
+        print(f"----- BENCHMARKING {os.path.basename(pdf_path)} -----")
+        runs = [benchmark_file(pdf_path, args, cascade_model_dir=args.cascade_model_dir) for _ in range(args.repeat)]
+        file = summarize(runs)
+
+        # The cascade is compared with running every chunk through the larger model
+        if args.cascade_model_dir:
+            print(f"----- BENCHMARKING {os.path.basename(pdf_path)} WITH {args.cascade_model_dir} ONLY -----")
+            cascade_model_runs = [benchmark_file(pdf_path, args, model_dir=args.cascade_model_dir) for _ in range(args.repeat)]
+            file["cascade_model_only_seconds"] = summarize(cascade_model_runs)["seconds"]["total"]
+            file["speedup_vs_cascade_model"] = file["cascade_model_only_seconds"] / file["seconds"]["total"]
+
+        report["files"][os.path.basename(pdf_path)] = file
+
+    # Totals over all files
+    files = report["files"].values()
+    totals = {}
+    totals["pages"] = sum(file["pages"] for file in files)
+    totals["chunks"] = sum(file["chunks"] for file in files)
+    totals["tokens"] = sum(file["tokens"] for file in files)
+    totals["seconds"] = {stage: sum(file["seconds"][stage] for file in files) for stage in STAGES + ["total"]}
+    totals["pages_per_second"] = totals["pages"] / totals["seconds"]["total"]
+    totals["tokens_per_second"] = totals["tokens"] / totals["seconds"]["predict"] if totals["seconds"]["predict"] else 0.0
+    totals["median_file_pages_per_second"] = statistics.median(file["pages_per_second"] for file in files)
+    if args.cascade_model_dir:
+        totals["escalated_chunks"] = sum(file["cascade"]["escalated"] for file in files if "cascade" in file)
+        totals["escalated_fraction"] = totals["escalated_chunks"] / max(sum(file["cascade"]["chunks"] for file in files if "cascade" in file), 1)
+        totals["cascade_model_only_seconds"] = sum(file["cascade_model_only_seconds"] for file in files)
+        totals["speedup_vs_cascade_model"] = totals["cascade_model_only_seconds"] / totals["seconds"]["total"]
+    if args.cache_pages:
+        totals["page_cache"] = {}
+        for counter in ["page_cache_hits", "page_cache_misses", "page_cache_evictions"]:
+            totals["page_cache"][counter.removeprefix("page_cache_")] = sum(file["counters"].get(counter, 0) for file in files)
+        lookups = totals["page_cache"]["hits"] + totals["page_cache"]["misses"]
+        totals["page_cache"]["hit_rate"] = totals["page_cache"]["hits"] / lookups if lookups else 0.0
+    report["totals"] = totals
+    report["peak_rss_mb"] = get_peak_rss_mb()
+
+    print("----- RESULTS -----")
+    print(f"{'FILE':<60}{'PAGES':>7}{'CHUNKS':>8}{'PAGES/S':>9}{'TOKENS/S':>10}" + "".join(f"{stage.upper():>13}" for stage in STAGES))
+    for file_name, file in report["files"].items():
+        print(f"{file_name[:58]:<60}{file['pages']:>7}{file['chunks']:>8}{file['pages_per_second']:>9.2f}{file['tokens_per_second']:>10.0f}" + "".join(f"{file['seconds'][stage]:>12.2f}s" for stage in STAGES))
+    print(f"{'TOTAL':<60}{totals['pages']:>7}{totals['chunks']:>8}{totals['pages_per_second']:>9.2f}{totals['tokens_per_second']:>10.0f}" + "".join(f"{totals['seconds'][stage]:>12.2f}s" for stage in STAGES))
+    if args.cascade_model_dir:
+        print(f"CASCADE: {totals['escalated_fraction']:.1%} OF THE CHUNKS ESCALATED, {totals['speedup_vs_cascade_model']:.2f}x FASTER THAN {args.cascade_model_dir} ONLY")
+    if args.cache_pages:
+        print(f"PAGE CACHE: {totals['page_cache']['hits']} HITS, {totals['page_cache']['misses']} MISSES, {totals['page_cache']['evictions']} EVICTIONS ({totals['page_cache']['hit_rate']:.1%} HIT RATE)")
+    print(f"MODEL LOAD: {report['model_load_seconds']:.2f}s")
+    print(f"PEAK RSS: {report['peak_rss_mb']:.0f} MB" if report["peak_rss_mb"] is not None else "PEAK RSS: not measured on this platform")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=4)
+        print(f"Saved report to {args.output}")
@@ -72,7 +72,9 @@ def render_extract_section() -> None:
                         label_visibility="collapsed", 
                         key=f"module_page_{file_obj.name}",
                         value=None,
-                        step=1
+                        step=1,
+                        placeholder="Auto-detect",
+                        help="Page no. where the modules begin. Leave empty to detect the module pages automatically."
                     )
                 with toggle_col:
                     st.toggle(
@@ -90,17 +92,17 @@ def render_extract_section() -> None:
         for file_name in file_names:
             selected_files_toggle_values.append(st.session_state[f"select_{file_name}"])
             selected_files_number_values.append(st.session_state[f"module_page_{file_name}"])
-            if st.session_state[f"select_{file_name}"] and st.session_state[f"module_page_{file_name}"] is not None:
+            if st.session_state[f"select_{file_name}"]:
                 files_for_extraction.append(file_name)
 
-        # Validation check if the user has selected the toggle and also given page number
+        # Validation check if the user has selected the toggle. The page number is optional.
         for operand_one, operande_two in zip(selected_files_toggle_values, selected_files_number_values):
             # Toggle selected and page no. entered (Button enabled)
             if operand_one and operande_two:
                 validation_list.append(True)
-            # Toggle selected but page no. not entered (Button disabled)
+            # Toggle selected but page no. not entered, module pages are detected automatically (Button enabled)
             if operand_one and not operande_two:
-                validation_list.append(False)
+                validation_list.append(True)
             # Toggle not selected but page no. entered (Button disabled)
             if not operand_one and operande_two:
                 validation_list.append(False)
@@ -130,6 +132,79 @@ def render_extract_section() -> None:
                 disabled=True
             )
 
+@st.fragment(run_every=1)
+def render_extraction_jobs() -> None:
+
+    """
+    Shows the progress of the background extraction jobs and refreshes itself every second.
+    Moves the results of finished jobs into `extracted_files`.
+    """
+
+    if "extraction_jobs" not in st.session_state or not st.session_state["extraction_jobs"]:
+        return
+
+    finished_new_files = False
+
+    for job in list(st.session_state["extraction_jobs"]):
+
+        # Results of finished jobs land in extracted_files
+        if job.status == "done":
+            st.session_state["extraction_jobs"].remove(job)
+            if job.tracer is not None:
+                st.session_state.setdefault("extraction_metrics", {})[job.name] = job.tracer.summary()
+            st.session_state["extracted_files"] = [file_obj for file_obj in st.session_state["extracted_files"] if file_obj["name"] != job.name]
+            st.session_state["extracted_files"].append(job.result)
+            st.toast(f"Extracted {job.name}", icon="✅")
+            finished_new_files = True
+            continue
+
+        card_container = st.container(border=True, key=f"job_container_{job.name}")
+        with card_container:
+            info_col, button_col = st.columns([0.8, 0.2], gap="small", vertical_alignment="center")
+
+            with info_col:
+                if job.status == "failed":
+                    st.error(f"Extraction of {job.name} failed: {job.error}")
+                elif job.status == "cancelled":
+                    st.warning(f"Extraction of {job.name} was cancelled")
+                else:
+                    progress_text = f"{job.name}: {job.stage}"
+                    if job.pages_total:
+                        progress_text += f" (page {job.pages_done} of {job.pages_total}"
+                        eta_seconds = job.get_eta_seconds()
+                        progress_text += f", about {int(eta_seconds)}s left)" if eta_seconds is not None else ")"
+                    st.progress(job.get_progress(), text=progress_text)
+
+                    if job.found_modules:
+                        st.caption(job.found_modules[-1])
+
+                    # Time spent in every stage so far
+                    if job.tracer is not None and job.tracer.spans:
+                        stage_seconds = job.tracer.get_stage_seconds()
+                        st.caption(" · ".join(f"{stage} {seconds:.1f}s" for stage, seconds in stage_seconds.items()))
+
+            with button_col:
+                if job.is_finished():
+                    st.button(
+                        label="Dismiss",
+                        key=f"dismiss_job_{job.name}",
+                        use_container_width=True,
+                        on_click=lambda x=job : st.session_state["extraction_jobs"].remove(x)
+                    )
+                else:
+                    st.button(
+                        label="Cancel",
+                        key=f"cancel_job_{job.name}",
+                        type="primary",
+                        use_container_width=True,
+                        disabled=job.is_cancelled(),
+                        on_click=job.cancel
+                    )
+
+    # Refresh the whole app so the other tabs see the new files
+    if finished_new_files:
+        st.rerun(scope="app")
+
 def render_download_section() -> None:
     if "extracted_files" in st.session_state:
         for file_obj in st.session_state["extracted_files"]:
@@ -1,50 +1,184 @@
 # This module is the heart of the app. All ML magic comes from here.
+# torch and transformers take seconds to import, so the modules which need them (inferencing, scheduler, model_registry)
+# are imported on first use and preloaded in the background. The pages render without waiting for them.
 
 import streamlit as st
 import time
+import uuid
+import threading
 from .utils import get_file_names
-from model_handler.inferencing import *
 from model_handler.postprocessing import *
+from model_handler.result_cache import result_cache
+from model_handler.instrumentation import Tracer
+from .jobs import ExtractionJob, get_active_jobs, start_pipeline
 
-# Function which runs the main extraction process
-def start_extraction(files_for_extraction:list):
-    
-    files = []
+# Metrics of every extraction are appended to this file
+METRICS_PATH = "./.cache/metrics/extractions.jsonl"
+
+# Read the module tables of known handbook layouts with rules and run the model only on the rest (see model_handler/layout_parser.py).
+# Off by default, as the rules do not extract exactly the same text as the model.
+PARSE_KNOWN_LAYOUTS = False
+
+# Set to a folder to capture torch profiler traces of the prediction stage (slow, for debugging only)
+PROFILE_DIR = None
+
+@st.cache_resource(show_spinner=False)
+def preload_models(model_dirs:list) -> threading.Thread:
+
+    """
+    Imports the ML stack and loads the models in `model_dirs` in a background thread, once per server process,
+    so the first extraction does not pay the cold start and the pages do not wait for it.
+    """
+
+    def preload():
+        import model_handler.inferencing
+        import model_handler.scheduler
+        from model_handler.model_registry import model_registry
+
+        model_registry.warm(model_dirs)
+
+    preload_thread = threading.Thread(target=preload, name="model-preload", daemon=True)
+    preload_thread.start()
+
+    return preload_thread
+
+def prepare_extraction(job:ExtractionJob) -> dict:
+
+    """
+    First stage of the extraction of one PDF file: checks the result cache, reads the PDF and tokenizes its pages.
+    Runs in the pipeline thread, one file after another.
+    """
+
+    # Waits for the preload thread if it is still importing
+    from model_handler.inferencing import ModelInteractor
+    from model_handler.scheduler import inference_scheduler
+
+    job.tracer = Tracer(job.name, profile_dir=PROFILE_DIR)
+    me = ModelInteractor(job.file_obj, job.module_start_page, parse_known_layouts=PARSE_KNOWN_LAYOUTS, scheduler=inference_scheduler, session_id=job.session_id, tracer=job.tracer)
+
+    prepared = {}
+    prepared["model_interactor"] = me
+
+    # Repeat uploads of the same file are served from the result cache
+    job.set_stage("Checking cache")
+    with job.tracer.span("cache_lookup"):
+        prepared["cache_key"] = result_cache.make_key(job.file_obj.getvalue(), me.module_start_page, me.get_model_identity())
+        extracted_file = result_cache.get(prepared["cache_key"])
+
+    if extracted_file is not None:
+        # The same PDF may have been uploaded under another name
+        extracted_file["name"] = job.name
+        prepared["extracted_file"] = extracted_file
+        job.tracer.count("cache_hits")
+        job.tracer.export_jsonl(METRICS_PATH)
+        return prepared
+
+    # Extract text from PDF file
+    job.set_stage("Reading PDF")
+    prepared["text_object"] = me.extract_text_from_pdf()
 
-    with st.status("Getting files...") as status:
-        
-        # Get file objects of selected files
-        for file_name in files_for_extraction:
-            for file_object in st.session_state["files"]:
-                if file_name == file_object.name:
-                    files.append(file_object)
+    job.set_stage("Tokenizing")
+    prepared["chunks"] = me.prepare_predictions(prepared["text_object"])
 
-        # Start extraction process one by one
-        for file_obj in files:
-            status.update(label=f"Extracting from {file_obj.name}", state="running", expanded=True)
+    job.set_stage("Waiting for the model")
 
-            me = ModelInteractor(file_obj, st.session_state[f"module_page_{file_object.name}"])
+    return prepared
 
-            # Extract text from PDF file
-            text_object = me.extract_text_from_pdf()
+def finish_extraction(job:ExtractionJob, prepared:dict) -> dict | None:
+
+    """
+    Second stage of the extraction of one PDF file: runs the model and post-processes its predictions.
+    Runs in the thread of the job, while the pipeline thread prepares the next file.
+
+    Reports the page progress on the `job` and stops early if the job is cancelled.
+    Returns the extracted file, or `None` if the job was cancelled.
+    """
+
+    if "extracted_file" in prepared:
+        return prepared["extracted_file"]
+
+    me = prepared["model_interactor"]
+    text_object = prepared["text_object"]
+
+    # Pages parsed from their tables count as well, even if none of their text goes to the model
+    page_numbers = set(me.rule_extractions)
+    for text_obj in text_object["content"]:
+        page_numbers.update(text_obj)
+    page_positions = {page_no: position for position, page_no in enumerate(sorted(page_numbers))}
+    job.pages_total = len(page_positions)
+
+    from model_handler.scheduler import inference_scheduler
+
+    # Other sessions may be using the model at the same time
+    queued_chunks = inference_scheduler.queue_depth()
+    job.set_stage(f"Predicting tokens ({queued_chunks} chunks queued before this file)" if queued_chunks else "Predicting tokens")
+
+    # Post-process the predictions batch by batch while the model works on the next pages
+    pp = PostProcess({"name": text_object["name"], "content": []}, tracer=job.tracer)
+
+    extracted_file = {}
+    extracted_file["name"] = text_object["name"]
+    extracted_file["extractions"] = []
+
+    predictions = me.stream_predictions(text_object, prepared["chunks"])
+    try:
+        with job.tracer.profile("predict_and_postprocess"):
+            for chunk in me.add_rule_extractions(pp.stream_extractions(predictions)):
+                if job.is_cancelled():
+                    return None
+
+                extracted_file["extractions"].append(chunk)
+                job.pages_done = page_positions.get(chunk["pdf_page_no"], 0) + 1
+
+                # Show the modules as soon as they are found
+                if "MODULE_NAME" in chunk["extracted_text"]:
+                    job.found_modules.append(f"Page {chunk['pdf_page_no']}: {chunk['extracted_text']['MODULE_NAME']}")
+    finally:
+        # Stops the prediction of the remaining chunks if the job was cancelled
+        predictions.close()
+
+    job.pages_done = job.pages_total
+    result_cache.put(prepared["cache_key"], extracted_file)
+    job.tracer.export_jsonl(METRICS_PATH)
+
+    return extracted_file
+
+# Function which starts the main extraction process
+def start_extraction(files_for_extraction:list):
 
-            status.update(label=f"Predicting tokens for {file_obj.name}", state="running", expanded=True)
+    """
+    Starts one background extraction job per selected file. The jobs are shown by `render_extraction_jobs`.
 
-            # Make predictions
-            results = me.make_predictions(text_object)
+    The jobs run as a pipeline (see `start_pipeline`): the chunks of all files go to the shared inference scheduler,
+    so the chunks of small files share batches.
+    """
 
-            status.update(label=f"Doing Post-processing for {file_obj.name}", state="running", expanded=True)
+    # Identifies this session in the queues of the shared inference scheduler
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
 
-            # Post-process the predictions
-            pp = PostProcess(results)
+    if "extraction_jobs" not in st.session_state:
+        st.session_state["extraction_jobs"] = []
 
-            # Merge subwords and assign text-labels to label IDs
-            pp.join_subwords_and_labels()
+    # Files which are already being extracted are not started again. Failed and cancelled jobs are replaced.
+    running_file_names = [job.name for job in get_active_jobs(st.session_state["extraction_jobs"])]
+    st.session_state["extraction_jobs"] = [job for job in st.session_state["extraction_jobs"] if job.name in running_file_names or job.name not in files_for_extraction]
 
-            # Grouping words with their labels
-            extracted_file = pp.group_words_to_labels()
+    new_jobs = []
+    for file_name in files_for_extraction:
+        if file_name in running_file_names:
+            continue
+        for file_object in st.session_state["files"]:
+            if file_name == file_object.name:
+                new_jobs.append(ExtractionJob(file_object, st.session_state[f"module_page_{file_name}"], st.session_state["session_id"]))
 
-            st.session_state["extracted_files"].append(extracted_file)
-        
-        status.update(label="Complete", state="complete", expanded=False)
+    # The files overlap: while the model runs on one file, the next one is read and tokenized
+    start_pipeline(new_jobs, prepare_extraction, finish_extraction)
+    st.session_state["extraction_jobs"].extend(new_jobs)
 
+    # Only the jobs which were started are counted, not the files which are still being extracted
+    num_running = sum(1 for file_name in files_for_extraction if file_name in running_file_names)
+    if new_jobs:
+        st.toast(f"Started extraction of {len(new_jobs)} file/s" + (f" ({num_running} already running)" if num_running else ""), icon="⏳")
+    elif num_running:
+        st.toast("The selected file/s are already being extracted", icon="ℹ️")
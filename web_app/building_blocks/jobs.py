@@ -0,0 +1,148 @@
+# This module runs extractions as background jobs, so the app stays usable while the model works.
+# A job runs in its own thread and never touches the session state. The app polls its progress instead.
+
+import time
+import threading
+from typing import Callable
+
+class ExtractionJob:
+
+    """
+    Extraction of one PDF file in a background thread.
+
+    `file_obj`: Uploaded PDF file.
+
+    `module_start_page`: Page no. where the modules begin in the PDF. `None` detects the module pages automatically.
+
+    `session_id`: Identifies the user session in the queues of the shared inference scheduler.
+    """
+
+    def __init__(self, file_obj, module_start_page:int, session_id:str):
+        self.file_obj = file_obj
+        self.name = file_obj.name
+        self.module_start_page = module_start_page
+        self.session_id = session_id
+
+        # Progress, updated by the job thread
+        self.status = "queued"
+        self.stage = "Waiting"
+        self.pages_done = 0
+        self.pages_total = 0
+        self.found_modules = []
+        self.started_at = None
+        self.stage_started_at = None
+        self.finished_at = None
+
+        # Tracer of the extraction (see model_handler/instrumentation.py), set when the job is prepared
+        self.tracer = None
+
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self._thread = None
+
+    def start(self, target:Callable, *args) -> None:
+
+        """
+        Runs `target(job, *args)` in a background thread. The return value of `target` becomes the result of the job.
+        """
+
+        self._thread = threading.Thread(target=self._run, args=(target, args), name=f"extraction-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self, target:Callable, args:tuple) -> None:
+
+        self.status = "running"
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        try:
+            self.result = target(self, *args)
+            self.status = "cancelled" if self.cancel_event.is_set() else "done"
+        except Exception as error:
+            self._fail(error)
+        self.finished_at = time.monotonic()
+
+    def run_stage(self, stage:Callable):
+
+        """
+        Runs `stage(job)` in the calling thread and returns its result. Returns `None` if the stage fails.
+        """
+
+        self.status = "running"
+        self.started_at = time.monotonic()
+        try:
+            return stage(self)
+        except Exception as error:
+            self._fail(error)
+            self.finished_at = time.monotonic()
+            return None
+
+    def _fail(self, error:Exception) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+        self.status = "failed"
+
+    def set_stage(self, stage:str) -> None:
+        self.stage = stage
+        self.stage_started_at = time.monotonic()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def is_finished(self) -> bool:
+        return self.status in ["done", "failed", "cancelled"]
+
+    def get_progress(self) -> float:
+        if self.status == "done":
+            return 1.0
+        if not self.pages_total:
+            return 0.0
+        return min(self.pages_done / self.pages_total, 1.0)
+
+    def get_eta_seconds(self) -> float | None:
+
+        """
+        Estimated seconds until the current stage is done, based on the pages processed so far.
+        """
+
+        if not self.pages_done or not self.pages_total or self.stage_started_at is None:
+            return None
+
+        elapsed = time.monotonic() - self.stage_started_at
+        return elapsed / self.pages_done * (self.pages_total - self.pages_done)
+
+def get_active_jobs(jobs:list) -> list:
+    return [job for job in jobs if not job.is_finished()]
+
+def start_pipeline(jobs:list, prepare:Callable, finish:Callable) -> threading.Thread:
+
+    """
+    Runs the jobs as a pipeline in a background thread.
+
+    `prepare(job)` (reading and tokenizing) runs for one job after another in the pipeline thread.
+    As soon as a job is prepared, `finish(job, prepared)` (inference and post-processing) starts in the thread
+    of the job, and the pipeline thread moves on to the next job. So while the model runs on one file,
+    the next file is prepared and the previous file is post-processed.
+    """
+
+    def run_pipeline():
+        for job in jobs:
+            if not job.is_cancelled():
+                prepared = job.run_stage(prepare)
+                if prepared is None:
+                    continue
+
+            # Jobs cancelled while waiting or while being prepared do not reach the model
+            if job.is_cancelled():
+                job.status = "cancelled"
+                job.finished_at = time.monotonic()
+                continue
+
+            job.start(finish, prepared)
+
+    pipeline_thread = threading.Thread(target=run_pipeline, name="extraction-pipeline", daemon=True)
+    pipeline_thread.start()
+
+    return pipeline_thread
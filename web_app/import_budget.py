@@ -0,0 +1,76 @@
+# Checks that the modules imported by the pages of the web-app stay fast to import.
+# torch, transformers and pymupdf are only allowed to load in the background (see building_blocks.core.preload_models),
+# so navigation and uploads never wait for them. Fails with exit code 1 if a page module pulls them in
+# or if importing the page modules takes longer than the budget.
+#
+# Example: python import_budget.py --budget-ms 1500
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# Modules imported by app_router.py and the pages in app_views
+PAGE_MODULES = ["streamlit", "building_blocks", "building_blocks.blocks", "building_blocks.core", "building_blocks.utils"]
+
+# Modules which must not be imported while the pages render
+HEAVY_MODULES = ["torch", "transformers", "pymupdf", "datasets", "onnxruntime"]
+
+# Runs in a fresh interpreter and prints the import time and the heavy modules which got imported
+IMPORT_SCRIPT = """
+import sys, json, time, importlib
+start_time = time.perf_counter()
+for module_name in sys.argv[2].split(","):
+    importlib.import_module(module_name)
+seconds = time.perf_counter() - start_time
+print(json.dumps({"seconds": seconds, "heavy_modules": [name for name in sys.argv[1].split(",") if name in sys.modules]}))
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the import time of the web-app pages.")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="Maximum median import time of the page modules in ms")
+    parser.add_argument("--repeat", type=int, default=3, help="Processes started for the measurement. The median is reported")
+    return parser.parse_args()
+
+def measure_import(modules:list, repeat:int) -> dict:
+
+    """
+    Imports `modules` in `repeat` new processes and returns the median import time and the heavy modules which got imported.
+    """
+
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, ",".join(HEAVY_MODULES), ",".join(modules)], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        "seconds": statistics.median(run["seconds"] for run in runs),
+        "heavy_modules": sorted(set(name for run in runs for name in run["heavy_modules"]))
+    }
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    print("----- MEASURING IMPORT TIME OF THE PAGES -----")
+    pages = measure_import(PAGE_MODULES, args.repeat)
+    print(f"PAGE MODULES: {pages['seconds'] * 1000:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    # For comparison: what the pages would pay if they imported the ML stack
+    ml_stack = measure_import(["model_handler.inferencing"], args.repeat)
+    print(f"ML STACK: {ml_stack['seconds'] * 1000:.0f} ms (loaded in the background)")
+
+    failed = False
+    if pages["heavy_modules"]:
+        print(f"FAILED: the page modules import {', '.join(pages['heavy_modules'])}")
+        failed = True
+    if pages["seconds"] * 1000 > args.budget_ms:
+        print("FAILED: the page modules exceed the import budget")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+    print("IMPORT BUDGET CHECK PASSED")
@@ -0,0 +1,69 @@
+# Compares an inference variant of the fine-tuned model against the fp32 model on the stage-three test split.
+# Reports the label-level F1 delta, the speedup and the memory saved, to decide per deployment which variant to ship.
+#
+# Example: python inference_report.py --quantize --model-dir ./model --dataset ../dataset/stage_three.zip
+# Example: python inference_report.py --precision bf16 --model-dir ./model --dataset ../dataset/stage_three.zip
+
+import copy
+import json
+import argparse
+import torch
+from transformers import AutoModelForTokenClassification
+from model_handler.model_registry import model_size_bytes
+from model_handler.backends import EagerBackend, quantize_model, is_bf16_supported
+from model_handler.evaluation import load_stage_three_test_split, predict_test_split, compare_predictions, print_report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare an inference variant against the fp32 model on the stage-three test split.")
+    parser.add_argument("--model-dir", default="./model", help="Folder of the fine-tuned model")
+    parser.add_argument("--dataset", default="../dataset/stage_three.zip", help="stage_three.zip or final_dataset.jsonl")
+    parser.add_argument("--quantize", action="store_true", help="Compare the dynamic int8 quantized model")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16"], help="Compare the forward pass under bf16 autocast")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N test samples")
+    parser.add_argument("--threads", type=int, default=None, help="Number of torch CPU threads")
+    parser.add_argument("--output", default=None, help="Optional path to save the report as JSON")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.quantize == (args.precision == "bf16"):
+        raise SystemExit("Select one inference variant to compare, e.g. --quantize or --precision bf16")
+
+    if args.precision == "bf16" and not is_bf16_supported(torch.device("cpu")):
+        print("----- NO NATIVE BF16 SUPPORT ON THIS CPU. BF16 IS EMULATED AND THE SPEEDUP IS NOT REPRESENTATIVE -----")
+
+    # Both variants run on the CPU, which is where the quantized and bf16 models are deployed
+    print("----- LOADING MODELS -----")
+    reference_model = AutoModelForTokenClassification.from_pretrained(args.model_dir).eval()
+    if args.quantize:
+        candidate_model = quantize_model(copy.deepcopy(reference_model))
+        candidate_name = "int8"
+    else:
+        # Same weights, only the forward pass runs under bf16 autocast
+        candidate_model = reference_model
+        candidate_name = "bf16"
+    candidate_runner = EagerBackend(candidate_model, precision=args.precision)
+
+    print("----- LOADING STAGE-THREE TEST SPLIT -----")
+    test_dataset = load_stage_three_test_split(args.dataset, limit=args.limit)
+    print(f"TEST SAMPLES: {len(test_dataset)}")
+
+    reference = predict_test_split(lambda ids, mask: reference_model(ids, attention_mask=mask).logits, test_dataset, args.batch_size)
+    candidate = predict_test_split(candidate_runner, test_dataset, args.batch_size)
+
+    report = compare_predictions(reference, candidate)
+    report["reference_size_mb"] = model_size_bytes(reference_model) / (1024 * 1024)
+    report["candidate_size_mb"] = model_size_bytes(candidate_model) / (1024 * 1024) if args.quantize else report["reference_size_mb"]
+
+    print_report(report, candidate_name)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=4)
+        print(f"Saved report to {args.output}")
@@ -0,0 +1,67 @@
+# Exports the fine-tuned model in ./model for the graph-optimized inference backends and checks parity with eager PyTorch.
+# The artifacts are written to ./model/exported and used by ModelInteractor(backend="torchscript") or ModelInteractor(backend="onnx").
+#
+# Example: python model_exporter.py --backend onnx --pdf "../dataset/stage_one/uni_kiel_bachelor_english.pdf"
+
+import sys
+import argparse
+import pymupdf
+import torch
+from transformers import AutoTokenizer
+from model_handler.model_registry import model_fingerprint
+from model_handler.backends import export_torchscript, export_onnx, load_backend, check_parity
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the model for a graph-optimized inference backend.")
+    parser.add_argument("--model-dir", default="./model", help="Folder of the fine-tuned model")
+    parser.add_argument("--backend", choices=["torchscript", "onnx"], required=True)
+    parser.add_argument("--pdf", default=None, help="PDF whose pages are used as inputs for the parity check")
+    parser.add_argument("--pages", type=int, default=16, help="Number of PDF pages used for the parity check")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Maximum absolute logit difference for the parity check")
+    return parser.parse_args()
+
+def get_parity_batches(tokenizer, pdf_path:str, num_pages:int, batch_size:int=4) -> list:
+
+    # Use real handbook pages if a PDF is given, otherwise a few label names
+    if pdf_path:
+        pdf_doc = pymupdf.open(pdf_path)
+        texts = [" ".join(page.get_text().split()) for page in pdf_doc][:num_pages]
+    else:
+        texts = ["Modulname Modul Nr. Leistungspunkte Arbeitsaufwand", "Module description Credit Points Workload Learning Targets Contents"]
+
+    batches = []
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[start:start + batch_size], truncation=True, max_length=512, padding=True, return_tensors="pt")
+        batches.append((encoded["input_ids"], encoded["attention_mask"]))
+
+    return batches
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    fingerprint = model_fingerprint(args.model_dir)
+    device = torch.device("cpu")
+
+    print(f"----- EXPORTING {args.model_dir} FOR THE {args.backend.upper()} BACKEND -----")
+    if args.backend == "torchscript":
+        artifact_path = export_torchscript(args.model_dir, tokenizer, fingerprint)
+    else:
+        artifact_path = export_onnx(args.model_dir, tokenizer, fingerprint)
+    print(f"Saved artifact to {artifact_path}")
+
+    print("----- CHECKING PARITY WITH EAGER PYTORCH -----")
+    reference = load_backend("eager", args.model_dir, fingerprint, device)
+    candidate = load_backend(args.backend, args.model_dir, fingerprint, device)
+    parity = check_parity(reference, candidate, get_parity_batches(tokenizer, args.pdf, args.pages))
+
+    print(f"TOKENS COMPARED: {parity['tokens']}")
+    print(f"MAX ABS LOGIT DIFF: {parity['max_abs_logit_diff']:.6f}")
+    print(f"LABEL AGREEMENT: {parity['label_agreement']:.2%}")
+
+    if parity["max_abs_logit_diff"] > args.tolerance or parity["label_agreement"] < 1.0:
+        print("PARITY CHECK FAILED")
+        sys.exit(1)
+
+    print("PARITY CHECK PASSED")
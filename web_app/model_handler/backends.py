@@ -0,0 +1,301 @@
+# This module contains the inference backends which run the forward pass of the token classifier.
+# Every backend is called as `backend(input_ids, attention_mask)` and returns the logits as a torch tensor.
+
+import os
+import json
+import functools
+import torch
+from transformers import AutoModelForTokenClassification
+
+BACKENDS = ["eager", "compile", "torchscript", "onnx"]
+
+# `auto` picks bf16 if the hardware has native bf16 matrix instructions, fp32 otherwise
+PRECISIONS = ["fp32", "bf16", "auto"]
+
+# Exported artifacts live in a sub folder so that they do not change the fingerprint of the model itself
+EXPORT_DIR_NAME = "exported"
+ARTIFACT_FILE_NAMES = {
+    "torchscript": "traced_model.pt",
+    "onnx": "model.onnx"
+}
+
+def get_artifact_path(model_dir:str, backend:str) -> str:
+    return os.path.join(model_dir, EXPORT_DIR_NAME, ARTIFACT_FILE_NAMES[backend])
+
+def _check_artifact(model_dir:str, backend:str, fingerprint:str) -> str:
+
+    # Make sure the artifact exists and was exported from the current checkpoint
+    artifact_path = get_artifact_path(model_dir, backend)
+    if not os.path.isfile(artifact_path):
+        raise FileNotFoundError(f"No {backend} artifact found at {artifact_path}. Export it first with model_exporter.py")
+
+    with open(artifact_path + ".json", "r", encoding="utf-8") as meta_file:
+        meta = json.load(meta_file)
+    if meta["fingerprint"] != fingerprint:
+        raise ValueError(f"The {backend} artifact at {artifact_path} was exported from an older checkpoint. Export it again with model_exporter.py")
+
+    return artifact_path
+
+def get_device(quantize:bool=False, backend:str="eager"):
+
+    # Quantized Linear layers and ONNX Runtime only run on the CPU, otherwise use GPU if available
+    if quantize or backend == "onnx":
+        return torch.device("cpu")
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+@functools.lru_cache(maxsize=None)
+def _cpu_has_bf16() -> bool:
+
+    if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        return False
+
+    # oneDNN also accepts bf16 on older AVX-512 CPUs, but emulates it there, which is slower than fp32.
+    # Only AVX512-BF16 and AMX have native bf16 matrix instructions.
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as cpuinfo_file:
+            cpu_flags = set(cpuinfo_file.read().split())
+    except OSError:
+        return True
+
+    return "avx512_bf16" in cpu_flags or "amx_bf16" in cpu_flags
+
+def is_bf16_supported(device) -> bool:
+
+    """
+    Returns `True` if `device` runs bf16 matrix multiplications natively.
+    """
+
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    return _cpu_has_bf16()
+
+def resolve_precision(precision:str="fp32", quantize:bool=False, backend:str="eager", verbose:bool=True) -> str:
+
+    """
+    Returns the precision (`fp32` or `bf16`) the forward pass runs in.
+
+    `precision`: One of `PRECISIONS`. `auto` and `bf16` fall back to fp32 if the device has no native bf16 support.
+    bf16 runs under autocast, so it is only supported by the eager and compile backends of the fp32 model.
+
+    `verbose`: Print a notice when `bf16` falls back to fp32.
+    """
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown inference precision {precision}. Choose one of {PRECISIONS}")
+
+    if precision == "fp32":
+        return "fp32"
+
+    if quantize or backend not in ["eager", "compile"]:
+        if precision == "bf16":
+            raise ValueError("bf16 inference is only supported by the eager and compile backends of the fp32 model")
+        return "fp32"
+
+    if not is_bf16_supported(get_device(quantize, backend)):
+        if precision == "bf16" and verbose:
+            print("----- NO NATIVE BF16 SUPPORT ON THIS DEVICE. FALLING BACK TO FP32 -----")
+        return "fp32"
+
+    return "bf16"
+
+def quantize_model(model):
+
+    """
+    Returns a dynamically quantized copy of `model` with int8 weights on all Linear layers.
+
+    Dynamic quantization runs on the CPU only.
+    """
+
+    return torch.ao.quantization.quantize_dynamic(model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8)
+
+class EagerBackend:
+
+    """
+    Runs the Hugging Face model in eager PyTorch. Optionally wrapped in `torch.compile`.
+
+    `precision`: `bf16` runs the forward pass under bf16 autocast. The weights stay in fp32 and the logits are returned in fp32.
+    """
+
+    def __init__(self, model, compile_model:bool=False, precision:str="fp32"):
+        self.model = model
+        self.size_bytes = None
+        self.name = "compile" if compile_model else "eager"
+        self.precision = precision
+        self._forward = torch.compile(model, dynamic=True) if compile_model else model
+
+    def __call__(self, input_ids, attention_mask):
+        if self.precision == "bf16":
+            with torch.autocast(device_type=input_ids.device.type, dtype=torch.bfloat16):
+                return self._forward(input_ids, attention_mask=attention_mask).logits.float()
+        return self._forward(input_ids, attention_mask=attention_mask).logits
+
+class TorchScriptBackend:
+
+    """
+    Runs a traced TorchScript module exported by `export_torchscript`.
+    """
+
+    def __init__(self, artifact_path:str, device):
+        self.model = None
+        self.name = "torchscript"
+        self.size_bytes = os.path.getsize(artifact_path)
+        self.module = torch.jit.load(artifact_path, map_location=device).eval()
+
+    def __call__(self, input_ids, attention_mask):
+        # Traced Hugging Face models return a tuple
+        return self.module(input_ids, attention_mask)[0]
+
+class OnnxBackend:
+
+    """
+    Runs an ONNX graph exported by `export_onnx` with ONNX Runtime.
+    """
+
+    def __init__(self, artifact_path:str, num_threads:int=None):
+        # onnxruntime is optional and only needed for this backend
+        import onnxruntime
+
+        self.model = None
+        self.name = "onnx"
+        self.size_bytes = os.path.getsize(artifact_path)
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+
+        self.session = onnxruntime.InferenceSession(artifact_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        inputs = {
+            "input_ids": input_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy()
+        }
+        logits = self.session.run(["logits"], inputs)[0]
+        return torch.from_numpy(logits)
+
+def load_backend(backend:str, model_dir:str, fingerprint:str, device, quantize:bool=False, precision:str="fp32"):
+
+    """
+    Loads the model of `model_dir` for the given inference `backend`.
+
+    `backend`: One of `BACKENDS`. `torchscript` and `onnx` need an artifact exported by `model_exporter.py`.
+
+    `precision`: `fp32` or `bf16` (see `resolve_precision`).
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}. Choose one of {BACKENDS}")
+
+    if quantize and backend not in ["eager", "compile"]:
+        raise ValueError(f"Quantized inference is only supported by the eager and compile backends, not {backend}")
+
+    if precision != "fp32" and (quantize or backend not in ["eager", "compile"]):
+        raise ValueError(f"{precision} inference is only supported by the eager and compile backends of the fp32 model")
+
+    if backend == "torchscript":
+        return TorchScriptBackend(_check_artifact(model_dir, backend, fingerprint), device)
+
+    if backend == "onnx":
+        return OnnxBackend(_check_artifact(model_dir, backend, fingerprint))
+
+    model = AutoModelForTokenClassification.from_pretrained(model_dir)
+    model.eval()
+    model = quantize_model(model) if quantize else model.to(device)
+
+    return EagerBackend(model, compile_model=(backend == "compile"), precision=precision)
+
+def _write_artifact_meta(artifact_path:str, backend:str, fingerprint:str) -> None:
+    with open(artifact_path + ".json", "w", encoding="utf-8") as meta_file:
+        json.dump({"backend": backend, "fingerprint": fingerprint, "torch_version": torch.__version__}, meta_file, indent=4)
+
+def _example_inputs(tokenizer):
+
+    # Two sequences of different length, so that the traced graph sees padding
+    encoded = tokenizer(["Modulname Lerninhalt", "Module description Credit Points Workload"], padding=True, return_tensors="pt")
+    return encoded["input_ids"], encoded["attention_mask"]
+
+def export_torchscript(model_dir:str, tokenizer, fingerprint:str) -> str:
+
+    """
+    Traces the model of `model_dir` into a TorchScript module and saves it next to the model.
+
+    Returns the path of the artifact.
+    """
+
+    model = AutoModelForTokenClassification.from_pretrained(model_dir, torchscript=True)
+    model.eval()
+
+    input_ids, attention_mask = _example_inputs(tokenizer)
+    with torch.no_grad():
+        traced_model = torch.jit.trace(model, (input_ids, attention_mask))
+
+    artifact_path = get_artifact_path(model_dir, "torchscript")
+    os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+    torch.jit.save(traced_model, artifact_path)
+    _write_artifact_meta(artifact_path, "torchscript", fingerprint)
+
+    return artifact_path
+
+def export_onnx(model_dir:str, tokenizer, fingerprint:str) -> str:
+
+    """
+    Exports the model of `model_dir` to an ONNX graph with dynamic batch and sequence axes.
+
+    Returns the path of the artifact.
+    """
+
+    model = AutoModelForTokenClassification.from_pretrained(model_dir)
+    model.eval()
+
+    input_ids, attention_mask = _example_inputs(tokenizer)
+    artifact_path = get_artifact_path(model_dir, "onnx")
+    os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (input_ids, attention_mask),
+            artifact_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch", 1: "sequence"}
+            },
+            opset_version=14
+        )
+    _write_artifact_meta(artifact_path, "onnx", fingerprint)
+
+    return artifact_path
+
+def check_parity(reference, candidate, batches:list) -> dict:
+
+    """
+    Compares the logits of a `candidate` backend with the `reference` (eager) backend.
+
+    `batches`: List of `(input_ids, attention_mask)` tensor pairs.
+
+    Returns the maximum absolute logit difference and the agreement of the predicted labels on real tokens.
+    """
+
+    max_abs_diff = 0.0
+    agreeing_tokens = 0
+    total_tokens = 0
+
+    for input_ids, attention_mask in batches:
+        with torch.no_grad():
+            reference_logits = reference(input_ids, attention_mask).float().cpu()
+            candidate_logits = candidate(input_ids, attention_mask).float().cpu()
+
+        mask = attention_mask.cpu().bool()
+        max_abs_diff = max(max_abs_diff, (reference_logits - candidate_logits)[mask].abs().max().item())
+        agreeing_tokens += (reference_logits.argmax(dim=-1) == candidate_logits.argmax(dim=-1))[mask].sum().item()
+        total_tokens += mask.sum().item()
+
+    return {
+        "max_abs_logit_diff": max_abs_diff,
+        "label_agreement": agreeing_tokens / max(total_tokens, 1),
+        "tokens": total_tokens
+    }
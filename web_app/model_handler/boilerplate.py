@@ -0,0 +1,95 @@
+# Detection of running headers, footers and page numbers which repeat on the pages of a handbook.
+# They carry no module information, but would be tokenized and predicted on every page.
+
+import re
+import math
+from collections import Counter
+from .page_classifier import label_patterns
+
+number_pattern = re.compile(r"\d+")
+
+class BoilerplateDetector:
+
+    """
+    Finds the lines at the top and bottom of the pages which repeat across the document and removes them.
+
+    Two kinds of lines are removed:
+    - Lines with the same text on many pages, e.g. the handbook title or the name of the faculty.
+    - Page counters, e.g. `12` or `Page 12 of 334`, whose number goes up with the page.
+
+    Lines which are a label keyword (see `page_classifier.py`), e.g. `Modulname` at the top of every module page, are never removed,
+    because the model needs them.
+    Module codes such as `mawi-12` repeat in the same place as well, but their numbers do not follow the pages.
+
+    `min_page_fraction`: Fraction of the pages a line must be found on to count as boilerplate.
+
+    `min_pages`: Minimum number of pages a line must be found on. Short documents are left as they are.
+
+    `edge_lines`: Number of lines at the top and at the bottom of a page which are checked. Headers and footers live there, the module tables do not.
+    """
+
+    def __init__(self, min_page_fraction:float=0.5, min_pages:int=3, edge_lines:int=3):
+        self.min_page_fraction = min_page_fraction
+        self.min_pages = min_pages
+        self.edge_lines = edge_lines
+
+    def _get_edge_indices(self, page_lines:list) -> list:
+        return sorted(set(range(min(self.edge_lines, len(page_lines)))) | set(range(max(len(page_lines) - self.edge_lines, 0), len(page_lines))))
+
+    def _get_counter_key(self, page_index:int, line:str) -> tuple | None:
+
+        # Page counters have the same text apart from their numbers, and their first number minus the page index is constant
+        first_number = number_pattern.search(line)
+        if first_number is None:
+            return None
+        return (number_pattern.sub("#", line), int(first_number.group()) - page_index)
+
+    def _is_protected(self, line:str) -> bool:
+        return any(pattern.fullmatch(line) for pattern in label_patterns.values())
+
+    def find_boilerplate(self, pages_lines:list) -> tuple:
+
+        """
+        Returns the set of repeated lines and the set of page counter keys of the document.
+
+        `pages_lines`: List with the list of (white space normalized) lines of every page.
+        """
+
+        line_counts = Counter()
+        counter_counts = Counter()
+        for page_index, page_lines in enumerate(pages_lines):
+            edge_lines = set(page_lines[index] for index in self._get_edge_indices(page_lines))
+            line_counts.update(edge_lines)
+            counter_counts.update(key for key in (self._get_counter_key(page_index, line) for line in edge_lines) if key is not None)
+
+        min_count = max(self.min_pages, math.ceil(self.min_page_fraction * len(pages_lines)))
+        repeated_lines = set(line for line, count in line_counts.items() if count >= min_count and not self._is_protected(line))
+        page_counters = set(key for key, count in counter_counts.items() if count >= min_count)
+
+        return (repeated_lines, page_counters)
+
+    def strip(self, pages_lines:list) -> tuple:
+
+        """
+        Removes the boilerplate lines from every page.
+
+        Returns the page texts (remaining lines joined with spaces) and the list of removed lines of every page.
+        """
+
+        repeated_lines, page_counters = self.find_boilerplate(pages_lines)
+
+        page_texts = []
+        removed_lines = []
+        for page_index, page_lines in enumerate(pages_lines):
+            edge_indices = set(self._get_edge_indices(page_lines))
+            kept_lines = []
+            page_removed_lines = []
+            for index, line in enumerate(page_lines):
+                if index in edge_indices and (line in repeated_lines or self._get_counter_key(page_index, line) in page_counters):
+                    page_removed_lines.append(line)
+                else:
+                    kept_lines.append(line)
+            page_texts.append(" ".join(kept_lines))
+            removed_lines.append(page_removed_lines)
+
+        return (page_texts, removed_lines)
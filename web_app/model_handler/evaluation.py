@@ -0,0 +1,133 @@
+# Helpers to compare inference variants of the token classifier on the stage-three test split.
+
+import os
+import json
+import time
+import zipfile
+import torch
+from datasets import Dataset
+from sklearn.metrics import f1_score
+from .postprocessing import label_id_map
+
+def load_stage_three_test_split(dataset_path:str, limit:int=None) -> Dataset:
+
+    """
+    Loads the stage-three dataset and returns the test split held out by `fine_tuner.py`.
+
+    `dataset_path`: Path to `final_dataset.jsonl` or to the `stage_three.zip` archive which contains it.
+
+    `limit`: Optional maximum number of test samples to return.
+    """
+
+    data = []
+    if zipfile.is_zipfile(dataset_path):
+        with zipfile.ZipFile(dataset_path) as archive:
+            jsonl_name = next(name for name in archive.namelist() if name.endswith(".jsonl"))
+            with archive.open(jsonl_name) as jsonl_file:
+                for line in jsonl_file:
+                    data.append(json.loads(line))
+    elif os.path.isfile(dataset_path):
+        with open(dataset_path, "r", encoding="utf-8") as jsonl_file:
+            for line in jsonl_file:
+                data.append(json.loads(line))
+    else:
+        raise FileNotFoundError(f"Stage-three dataset not found at {dataset_path}")
+
+    # Same columns and split as FineTuner.prepare_dataset
+    dataset = Dataset.from_list(data)
+    columns_to_keep = ["input_ids", "attention_mask", "labels"]
+    dataset = dataset.remove_columns([col for col in dataset.column_names if col not in columns_to_keep])
+    test_dataset = dataset.train_test_split(test_size=0.2, seed=42)["test"]
+
+    if limit is not None:
+        test_dataset = test_dataset.select(range(min(limit, len(test_dataset))))
+
+    return test_dataset
+
+def predict_test_split(forward, test_dataset:Dataset, batch_size:int=16, device=torch.device("cpu")) -> dict:
+
+    """
+    Runs `forward` over the test split and collects the predicted and true label IDs of all labelled tokens.
+
+    `forward`: Callable `forward(input_ids, attention_mask)` which returns the logits of a batch.
+
+    Returns a dictionary with `true_labels`, `pred_labels` and the total forward time in `seconds`.
+    """
+
+    true_labels = []
+    pred_labels = []
+    seconds = 0.0
+
+    # Warm-up pass so that one-off initialisation is not counted in the timing
+    warmup_batch = test_dataset[0:1]
+    with torch.no_grad():
+        forward(torch.tensor(warmup_batch["input_ids"]).to(device), torch.tensor(warmup_batch["attention_mask"]).to(device))
+
+    for start in range(0, len(test_dataset), batch_size):
+        batch = test_dataset[start:start + batch_size]
+        input_ids = torch.tensor(batch["input_ids"]).to(device)
+        attention_mask = torch.tensor(batch["attention_mask"]).to(device)
+        labels = torch.tensor(batch["labels"])
+
+        start_time = time.perf_counter()
+        with torch.no_grad():
+            logits = forward(input_ids, attention_mask)
+        seconds += time.perf_counter() - start_time
+
+        predictions = logits.argmax(dim=-1).cpu()
+        labelled = labels != -100
+        true_labels.extend(labels[labelled].tolist())
+        pred_labels.extend(predictions[labelled].tolist())
+
+    return {"true_labels": true_labels, "pred_labels": pred_labels, "seconds": seconds}
+
+def compare_predictions(reference:dict, candidate:dict) -> dict:
+
+    """
+    Compares the output of `predict_test_split` for a reference (fp32) and a candidate inference variant.
+
+    Returns the weighted F1 of both, the per-label F1 delta, the label agreement and the speedup.
+    """
+
+    true_labels = reference["true_labels"]
+    labels = sorted(set(true_labels))
+    id_label_map = {value: key for key, value in label_id_map.items()}
+
+    reference_f1 = f1_score(true_labels, reference["pred_labels"], labels=labels, average=None, zero_division=0)
+    candidate_f1 = f1_score(true_labels, candidate["pred_labels"], labels=labels, average=None, zero_division=0)
+
+    agreement = sum(1 for ref, cand in zip(reference["pred_labels"], candidate["pred_labels"]) if ref == cand)
+
+    report = {}
+    report["tokens"] = len(true_labels)
+    report["reference_f1"] = f1_score(true_labels, reference["pred_labels"], average="weighted")
+    report["candidate_f1"] = f1_score(true_labels, candidate["pred_labels"], average="weighted")
+    report["f1_delta"] = report["candidate_f1"] - report["reference_f1"]
+    report["label_agreement"] = agreement / max(len(true_labels), 1)
+    report["reference_seconds"] = reference["seconds"]
+    report["candidate_seconds"] = candidate["seconds"]
+    report["speedup"] = reference["seconds"] / candidate["seconds"] if candidate["seconds"] else 0.0
+    report["label_f1_delta"] = {
+        id_label_map.get(label, str(label)): float(cand - ref) for label, ref, cand in zip(labels, reference_f1, candidate_f1)
+    }
+
+    return report
+
+def print_report(report:dict, candidate_name:str) -> None:
+
+    """
+    Prints a report from `compare_predictions` to the console.
+    """
+
+    print(f"----- FP32 vs {candidate_name.upper()} ON {report['tokens']} LABELLED TOKENS -----")
+    print(f"WEIGHTED F1 (FP32): {report['reference_f1']:.4f}")
+    print(f"WEIGHTED F1 ({candidate_name.upper()}): {report['candidate_f1']:.4f}")
+    print(f"F1 DELTA: {report['f1_delta']:+.4f}")
+    print(f"LABEL AGREEMENT: {report['label_agreement']:.2%}")
+    print(f"FORWARD TIME: {report['reference_seconds']:.2f}s vs {report['candidate_seconds']:.2f}s (SPEEDUP {report['speedup']:.2f}x)")
+    if "reference_size_mb" in report:
+        print(f"MODEL SIZE: {report['reference_size_mb']:.1f} MB vs {report['candidate_size_mb']:.1f} MB (SAVED {report['reference_size_mb'] - report['candidate_size_mb']:.1f} MB)")
+
+    print("----- PER-LABEL F1 DELTA -----")
+    for label, delta in sorted(report["label_f1_delta"].items(), key=lambda item: item[1]):
+        print(f"{label}: {delta:+.4f}")
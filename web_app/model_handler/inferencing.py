@@ -1,59 +1,216 @@
 import torch
-import pymupdf
-from transformers import AutoTokenizer, AutoModelForTokenClassification
-import io
+from collections import Counter
+from transformers import AutoConfig
+from .model_registry import model_registry, model_fingerprint
+from .backends import resolve_precision
+from .pdf_reader import extract_page_texts
+from .page_cache import page_cache, chunk_key
+from .page_classifier import PageClassifier
+from .boilerplate import BoilerplateDetector
+from .layout_parser import LayoutParser
+from .instrumentation import null_tracer
+
+# Maximum time to wait for one scheduled chunk, including the chunks of other sessions which run before it
+SCHEDULER_TIMEOUT_SECONDS = 600
+
+# Pairs of cascade models (by model id) whose vocabularies and labels were found to match
+_checked_cascades = set()
+
+def _check_cascade(loaded_model, cascade_model) -> None:
+
+    # The chunks are tokenized once, so both models must share the vocabulary and the labels
+    key = (loaded_model.model_id, cascade_model.model_id)
+    if key in _checked_cascades:
+        return
+
+    if loaded_model.tokenizer.get_vocab() != cascade_model.tokenizer.get_vocab():
+        raise ValueError(f"The cascade models {loaded_model.model_dir} and {cascade_model.model_dir} have different vocabularies")
+    if AutoConfig.from_pretrained(loaded_model.model_dir).id2label != AutoConfig.from_pretrained(cascade_model.model_dir).id2label:
+        raise ValueError(f"The cascade models {loaded_model.model_dir} and {cascade_model.model_dir} have different labels")
+
+    _checked_cascades.add(key)
+
+def _is_out_of_memory(error:Exception) -> bool:
+
+    """
+    Checks if an exception raised during the forward pass is a failed memory allocation (GPU or CPU).
+    """
+
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    message = str(error)
+    return "out of memory" in message or "can't allocate memory" in message
+
+def get_labels_and_confidences(logits) -> tuple:
+
+    """
+    Returns the label ID and the confidence (max. softmax probability) of every token of `logits` ([batch, tokens, labels]).
+
+    The logits are overwritten: the probabilities are computed in place, without a second [batch, tokens, labels] tensor.
+    """
+
+    max_logits, predictions = torch.max(logits, dim=2)
+
+    # The largest probability is exp(0) / sum(exp(logits - max_logits))
+    confidence_scores = logits.sub_(max_logits.unsqueeze(2)).exp_().sum(dim=2).reciprocal_()
+
+    return (predictions, confidence_scores)
 
 class ModelInteractor:
 
-    def __init__(self, pdf_file_object, module_start_page:int):
+    """
+    Runs the fine-tuned token classifier on the pages of a PDF file.
+
+    `module_start_page`: Page no. where the modules begin. `None` detects the module description pages automatically (see `page_classifier.py`).
+
+    `batch_size`: Maximum number of chunks per forward pass. `None` runs all chunks in one batch.
+
+    `max_batch_tokens`: Optional limit on the number of (padded) tokens per forward pass.
+
+    `quantize`: Run the dynamically int8 quantized model on the CPU instead of the fp32 model.
+
+    `backend`: Inference backend, one of `eager`, `compile`, `torchscript` or `onnx`. See `model_exporter.py`.
+
+    `precision`: `fp32`, `bf16` or `auto`. `bf16` runs the forward pass under bf16 autocast on CPUs with native bf16
+    instructions (AVX512-BF16, AMX) and on GPUs which support it, and falls back to fp32 elsewhere. `auto` picks bf16 where it is supported.
+
+    `pack_pages`: Pack the text of consecutive short pages into shared chunks to cut the number of sequences.
+
+    `strip_boilerplate`: Remove running headers, footers and page numbers which repeat across the pages before tokenization (see `boilerplate.py`).
+
+    `parse_known_layouts`: Read the module tables of known handbook layouts (TU Darmstadt, h_da, Bonn, Kiel, RWTH) with rules
+    (see `layout_parser.py`). The model only runs on the pages without parsed tables and on the text outside the tables.
+
+    `extraction_workers`: Maximum number of worker processes for reading the PDF. `None` picks it from the CPU count.
+
+    `cascade_model_dir`: Optional folder of a larger model with the same tokenizer and labels, e.g. the bert fine-tune when
+    `model_dir` holds the distilbert fine-tune. Every chunk is predicted by the model in `model_dir` first, and only the uncertain
+    chunks are predicted again by the cascade model.
+
+    `cascade_threshold`: Tokens with a confidence below this value are uncertain.
+
+    `cascade_max_uncertain`: Fraction of uncertain tokens a chunk may have before it is passed to the cascade model.
+
+    `cache_pages`: Reuse the predictions of chunks which were already predicted by the same model (see `page_cache.py`).
+    Identical chunks within one document are always predicted only once.
+
+    `scheduler`: Optional shared `InferenceScheduler` (see `scheduler.py`) which batches the chunks together with those of other sessions.
+    `batch_size` and `max_batch_tokens` are then set by the scheduler.
+
+    `session_id`: Identifies the user session in the queues of the scheduler.
+
+    `tracer`: Optional `Tracer` (see `instrumentation.py`) which records the duration of every stage and the chunk and token counts.
+    """
+
+    def __init__(self, pdf_file_object, module_start_page:int=None, model_dir:str="./model", batch_size:int=8, max_batch_tokens:int=None, quantize:bool=False, backend:str="eager", precision:str="fp32", pack_pages:bool=False, strip_boilerplate:bool=False, parse_known_layouts:bool=False, extraction_workers:int=None, cascade_model_dir:str=None, cascade_threshold:float=0.9, cascade_max_uncertain:float=0.01, cache_pages:bool=True, scheduler=None, session_id:str=None, tracer=None):
         self.pdf_file_object = pdf_file_object
         self.module_start_page = module_start_page
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.quantize = quantize
+        self.backend = backend
+        self.precision = resolve_precision(precision, quantize, backend)
+        self.pack_pages = pack_pages
+        self.strip_boilerplate = strip_boilerplate
+        self.removed_lines = None
+        self.boilerplate_stats = {}
+        self.parse_known_layouts = parse_known_layouts
+        self.rule_extractions = {}
+        self.layout_stats = {}
+        self.extraction_workers = extraction_workers
+        self.cascade_model_dir = cascade_model_dir
+        self.cascade_threshold = cascade_threshold
+        self.cascade_max_uncertain = cascade_max_uncertain
+        self.cascade_stats = {}
+        self.cache_pages = cache_pages
+        self.cache_stats = {}
+        self.scheduler = scheduler
+        self.session_id = session_id if session_id is not None else str(id(self))
+        self.tracer = tracer if tracer is not None else null_tracer
 
     def _split_into_chunks(self, tokenizer, zipped_contents):
 
+        """
+        Tokenizes all pages in one batched call of the fast tokenizer and splits long pages into overlapping chunks.
+
+        Each chunk is `[is_overlapped, page_no, token_ids, offsets, page_spans]`, where `offsets` are the
+        `(start, end)` character positions of every token in the page text and `page_spans` is the list
+        of `(page_no, token_count)` pairs which maps the tokens of the chunk to their pages.
+        """
+
         chunks = []
         max_length = 510
         overlap = 50
 
-        for page_no, text in zipped_contents:
-            tokens = tokenizer(text, add_special_tokens=False)["input_ids"]
-            token_length = len(tokens)
+        zipped_contents = list(zipped_contents)
+        if not zipped_contents:
+            return chunks
+
+        if not tokenizer.is_fast:
+            raise ValueError("Chunking needs a fast tokenizer (tokenizer.json) in the model folder")
+
+        page_numbers = [page_no for page_no, _ in zipped_contents]
+        texts = [text for _, text in zipped_contents]
+
+        # Windows of max_length tokens, each overflowing window repeats the last `overlap` tokens of the previous one
+        encodings = tokenizer(
+            texts,
+            add_special_tokens=False,
+            truncation=True,
+            max_length=max_length,
+            stride=overlap,
+            return_overflowing_tokens=True,
+            return_offsets_mapping=True
+        )
+
+        previous_page_index = None
+        for tokens, offsets, page_index in zip(encodings["input_ids"], encodings["offset_mapping"], encodings["overflow_to_sample_mapping"]):
+            # First window of a page is not overlapped, all following windows are
+            is_overlapped = page_index == previous_page_index
+            chunks.append([is_overlapped, page_numbers[page_index], tokens, offsets, [(page_numbers[page_index], len(tokens))]])
+            previous_page_index = page_index
+
+        return chunks
+
+    def _pack_chunks(self, chunks:list, max_length:int=510) -> list:
+
+        """
+        Packs consecutive pages which fit into a single chunk together, up to `max_length` tokens per chunk.
+
+        Pages which are split into overlapping chunks are left as they are. The `page_spans` of a packed
+        chunk keep track of which tokens belong to which page.
+        """
 
-            # If the text is already short, add it as a single chunk
-            if token_length <= max_length:
-                chunks.append([False, page_no, tokens])
+        packed_chunks = []
+        current = None
+
+        for index, chunk_set in enumerate(chunks):
+            is_overlapped, page_no, tokens, offsets, page_spans = chunk_set
+            next_is_overlapped = index + 1 < len(chunks) and chunks[index + 1][0]
+            fits_in_one_chunk = not is_overlapped and not next_is_overlapped
+
+            # Long pages keep their own overlapping chunks
+            if not fits_in_one_chunk:
+                if current is not None:
+                    packed_chunks.append(current)
+                    current = None
+                packed_chunks.append(chunk_set)
+                continue
+
+            if current is not None and len(current[2]) + len(tokens) <= max_length:
+                current[2] = current[2] + tokens
+                current[3] = current[3] + offsets
+                current[4] = current[4] + page_spans
             else:
-                start = 0
-                while start < token_length:
-                    # Ensure the last chunk is not out of bounds
-                    end = min(start + max_length, token_length)
-                    chunk = tokens[start:end]
-                    
-                    # Check if it is first chunk
-                    if start == 0 and len(chunk) == 510:
-                        chunks.append([False, page_no, chunk])
-                    # For other chunks
-                    else:
-                        chunks.append([True, page_no, chunk])
-
-                    # Stop if we've reached the last token
-                    if end == token_length:
-                        break
-
-                    # Slide window forward
-                    start += max_length - overlap
-
-                # Ensure last chunk has overlap only if it is too small
-                if len(chunks) > 1:
-                    last_chunk_len = len(chunks[-1][2])
-                    if last_chunk_len < overlap:
-                        # Second-last chunk
-                        prev_chunk = chunks[-2][2]
-                        chunks[-1][2] = prev_chunk[-overlap:] + chunks[-1][2]
-                        # Change overlap flag to True
-                        chunks[-1][0] = True
+                if current is not None:
+                    packed_chunks.append(current)
+                current = [False, page_no, list(tokens), list(offsets), list(page_spans)]
 
-        return chunks
+        if current is not None:
+            packed_chunks.append(current)
+
+        return packed_chunks
 
     def _add_special_tokens(self, tokenizer, chunks):
 
@@ -63,6 +220,8 @@ class ModelInteractor:
         input_ids = []
         chunk_pages = []
         chunk_overlaps = []
+        chunk_offsets = []
+        chunk_page_spans = []
 
         for chunk_set in chunks:
             sample = chunk_set[2]
@@ -71,54 +230,164 @@ class ModelInteractor:
             input_ids.append(sample)
             chunk_pages.append(chunk_set[1])
             chunk_overlaps.append(chunk_set[0])
-        
-        # Adding padding
-        max_length = max(len(chunk) for chunk in input_ids)
-        input_ids_padded = [chunk + [tokenizer.pad_token_id] * (max_length - len(chunk)) for chunk in input_ids]
+            chunk_offsets.append(chunk_set[3])
+            chunk_page_spans.append(chunk_set[4])
+
+        # Padding is added per batch in _pad_batch
+        return (input_ids, chunk_pages, chunk_overlaps, chunk_offsets, chunk_page_spans)
+
+    def _pad_batch(self, tokenizer, batch_input_ids:list, device):
+
+        # Pad only up to the longest chunk of this batch
+        max_length = max(len(chunk) for chunk in batch_input_ids)
+        input_ids_padded = [chunk + [tokenizer.pad_token_id] * (max_length - len(chunk)) for chunk in batch_input_ids]
 
         # Create attention_mask
-        attention_mask = [[1] * len(chunk) + [0] * (max_length - len(chunk)) for chunk in input_ids]
+        attention_mask = [[1] * len(chunk) + [0] * (max_length - len(chunk)) for chunk in batch_input_ids]
 
-        return (input_ids_padded, attention_mask, chunk_pages, chunk_overlaps)
+        # Converting input and mask to tensors
+        return (torch.tensor(input_ids_padded).to(device), torch.tensor(attention_mask).to(device))
+
+    def _get_batch_size(self, num_chunks:int, padded_length:int, batch_size:int) -> int:
+
+        # Number of chunks per forward pass allowed by batch_size and max_batch_tokens
+        batch_size = min(batch_size, num_chunks)
+        if self.max_batch_tokens is not None:
+            batch_size = min(batch_size, self.max_batch_tokens // padded_length)
+
+        return max(batch_size, 1)
+
+    def _run_batches(self, runner, tokenizer, input_ids:list, device, sort_by_length:bool=True):
+
+        """
+        Runs the model over the chunks in memory-bounded micro-batches. Each batch is padded only to its own longest chunk.
+
+        `sort_by_length`: Sort the chunks by length so that each batch holds chunks of similar length.
+        Otherwise the batches follow the document order.
+
+        Yields `(batch_indices, predictions, confidences)` per batch, where `predictions` and `confidences` are
+        device tensors of the content tokens (without [CLS], [SEP] and padding) of every chunk in `batch_indices`.
+
+        If a batch fails to allocate memory, the batch size is halved and the batch is retried.
+        """
+
+        # The shared scheduler forms the batches across sessions
+        if self.scheduler is not None:
+            yield from self._run_scheduled(runner, tokenizer, input_ids, device)
+            return
+
+        num_chunks = len(input_ids)
+        batch_size = num_chunks if self.batch_size is None else self.batch_size
+
+        # Longest chunks first, so a failed allocation shows up on the first batch
+        if sort_by_length:
+            order = sorted(range(num_chunks), key=lambda i: len(input_ids[i]), reverse=True)
+        else:
+            order = list(range(num_chunks))
+
+        position = 0
+        while position < num_chunks:
+            batch_candidates = order[position:position + batch_size]
+            padded_length = max(len(input_ids[i]) for i in batch_candidates)
+            current_batch_size = self._get_batch_size(num_chunks - position, padded_length, batch_size)
+            batch_indices = order[position:position + current_batch_size]
+
+            batch_input_ids, batch_attention_mask = self._pad_batch(tokenizer, [input_ids[i] for i in batch_indices], device)
+            try:
+                with torch.no_grad(), self.tracer.span("forward", chunks=len(batch_indices), padded_length=padded_length):
+                    logits = runner(batch_input_ids, batch_attention_mask)
+            except RuntimeError as error:
+                if not _is_out_of_memory(error) or current_batch_size == 1:
+                    raise
+                # Retry the same chunks with a smaller batch
+                batch_size = max(current_batch_size // 2, 1)
+                print(f"----- OUT OF MEMORY. RETRYING WITH BATCH SIZE {batch_size} -----")
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                continue
 
-    def extract_text_from_pdf(self):
+            # Label and confidence (max. softmax probability) of every token
+            predictions, confidence_scores = get_labels_and_confidences(logits)
 
-        pdf_text = {}
-        pdf_text["name"] = self.pdf_file_object.name
-        pdf_text["content"] = []
+            # Drop special tokens and padding
+            batch_predictions = []
+            batch_confidences = []
+            for row, chunk_index in enumerate(batch_indices):
+                content_end = len(input_ids[chunk_index]) - 1
+                batch_predictions.append(predictions[row, 1:content_end])
+                batch_confidences.append(confidence_scores[row, 1:content_end])
 
-        file_bytes = self.pdf_file_object.getvalue()
+            self.tracer.count("batches")
+            self.tracer.count("padded_tokens", len(batch_indices) * max(len(input_ids[i]) for i in batch_indices))
 
-        pdf_doc = pymupdf.open("pdf", io.BytesIO(file_bytes))
+            yield (batch_indices, batch_predictions, batch_confidences)
 
-        for page_number, page in enumerate(pdf_doc):
-            if page_number < self.module_start_page - 1:
-                continue
-            else:
-                text = page.get_text().replace("\n", " ")
-                text = " ".join(text.split())
-                pdf_text["content"].append(
-                    {
-                        page_number+1:text
-                    }
-                )
+            position += current_batch_size
 
-        return pdf_text
-    
-    def make_predictions(self, pdf_text:dict):
+    def _run_scheduled(self, runner, tokenizer, input_ids:list, device):
 
-        results = {}
-        results["name"] = pdf_text["name"]
-        results["content"] = []
+        """
+        Submits all chunks to the shared scheduler and yields them in document order as they are done,
+        in the same form as `_run_batches`.
+        """
+
+        futures = self.scheduler.submit(self.session_id, runner, tokenizer, device, input_ids)
+
+        position = 0
+        try:
+            while position < len(futures):
+                # Includes the time the scheduler spends on the chunks of other sessions
+                with self.tracer.span("scheduler_wait"):
+                    try:
+                        futures[position].result(timeout=SCHEDULER_TIMEOUT_SECONDS)
+                    except TimeoutError:
+                        raise TimeoutError(f"The inference scheduler did not run chunk {position} of {len(futures)} within {SCHEDULER_TIMEOUT_SECONDS}s")
+
+                # Take all following chunks which are already done as well
+                end = position + 1
+                while end < len(futures) and futures[end].done():
+                    end += 1
+
+                batch_indices = list(range(position, end))
+                batch_results = [futures[i].result() for i in batch_indices]
+                yield (batch_indices, [result[0] for result in batch_results], [result[1] for result in batch_results])
+
+                position = end
+        finally:
+            # Chunks which are still queued are dropped if the caller stops early
+            for future in futures[position:]:
+                future.cancel()
+
+    def _to_host(self, chunk_predictions:list, chunk_confidences:list) -> tuple:
+
+        """
+        Moves the predictions and confidences of several chunks to the host in one transfer.
 
-        # Load the model
-        model = AutoModelForTokenClassification.from_pretrained("./model")
-        tokenizer = AutoTokenizer.from_pretrained("./model")
+        Returns two lists (label IDs and confidences) with one list of Python numbers per chunk.
+        """
 
-        # Move model to GPU if available
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)
+        with self.tracer.span("to_host"):
+            if not chunk_predictions:
+                return ([], [])
 
+            lengths = [len(chunk) for chunk in chunk_predictions]
+            host_values = torch.stack((torch.cat(chunk_predictions).float(), torch.cat(chunk_confidences).float())).cpu().tolist()
+
+            predictions_list = []
+            confidences_list = []
+            start = 0
+            for length in lengths:
+                predictions_list.append([int(label_id) for label_id in host_values[0][start:start + length]])
+                confidences_list.append(host_values[1][start:start + length])
+                start += length
+
+            return (predictions_list, confidences_list)
+
+    def _prepare_chunks(self, tokenizer, pdf_text:dict) -> dict:
+
+        """
+        Tokenizes the pages of `pdf_text` and returns the chunks ready for the model.
+        """
 
         # Zip the contents to preserve page and text order
         page_numbers = []
@@ -129,38 +398,440 @@ class ModelInteractor:
                 contents.append(value)
         zipped_contents = zip(page_numbers, contents)
 
-        # Make chunks
-        chunks = self._split_into_chunks(tokenizer, zipped_contents)
+        with self.tracer.span("tokenize"):
+            # Make chunks
+            chunks = self._split_into_chunks(tokenizer, zipped_contents)
 
-        # Add special tokens
-        input_ids_padded, attention_mask, chunk_pages, chunk_overlaps = self._add_special_tokens(tokenizer, chunks)
+            # Fill chunks with text from consecutive short pages
+            if self.pack_pages:
+                chunks = self._pack_chunks(chunks)
 
-        # Converting input and mask to tensors
-        input_ids_padded = torch.tensor(input_ids_padded).to(device)
-        attention_mask = torch.tensor(attention_mask).to(device)
-
-        # Getting model predictions in one batch
-        with torch.no_grad():
-            outputs = model(input_ids_padded, attention_mask=attention_mask)
-        
-        logits = outputs.logits
-        probabilities = torch.nn.functional.softmax(logits, dim=2)
-        confidence_scores, predictions = torch.max(probabilities, dim=2)
-
-        # Align everything togther
-        # Iterate over each chunk
-        for i in range(len(input_ids_padded)):
-            # Convert token IDs to text tokens
-            tokenized_words = tokenizer.convert_ids_to_tokens(input_ids_padded[i])
-            
-            result = {}
-            result["chunk_page_no"] = chunk_pages[i]
-            result["is_overlapped"] = chunk_overlaps[i]
-            result["predictions"] = []
-            for word, tag, confidence in zip(tokenized_words, predictions[i].cpu().numpy(), confidence_scores[i].cpu().numpy()):
-                if word not in ["[CLS]", "[SEP]", "[PAD]"]:  # Ignore special tokens
-                    result["predictions"].append((word, tag, confidence))
+            # Add special tokens
+            input_ids, chunk_pages, chunk_overlaps, chunk_offsets, chunk_page_spans = self._add_special_tokens(tokenizer, chunks)
+
+        self.tracer.count("chunks", len(input_ids))
+        self.tracer.count("tokens", sum(len(chunk) for chunk in input_ids))
+
+        if self.removed_lines:
+            self._count_boilerplate_tokens(tokenizer)
+
+        prepared_chunks = {}
+        prepared_chunks["input_ids"] = input_ids
+        prepared_chunks["overlaps"] = chunk_overlaps
+        prepared_chunks["offsets"] = chunk_offsets
+        prepared_chunks["page_spans"] = chunk_page_spans
+
+        return prepared_chunks
+
+    def _count_boilerplate_tokens(self, tokenizer) -> None:
+
+        # Every removed line is tokenized once and counted as often as it was removed
+        tokens_saved = 0
+        for line, count in self.removed_lines.items():
+            tokens_saved += count * len(tokenizer(line, add_special_tokens=False)["input_ids"])
+
+        self.boilerplate_stats["lines_removed"] = sum(self.removed_lines.values())
+        self.boilerplate_stats["unique_lines_removed"] = len(self.removed_lines)
+        self.boilerplate_stats["tokens_saved"] = tokens_saved
+        self.tracer.count("boilerplate_lines_removed", self.boilerplate_stats["lines_removed"])
+        self.tracer.count("boilerplate_tokens_saved", tokens_saved)
+
+        print(f"----- REMOVED {self.boilerplate_stats['lines_removed']} BOILERPLATE LINES ({tokens_saved} TOKENS) -----")
+
+    def _build_results(self, tokenizer, prepared_chunks:dict, chunk_indices:list, chunk_predictions:list, chunk_confidences:list) -> list:
+
+        """
+        Aligns tokens, labels, confidences and offsets of the chunks in `chunk_indices` and returns one result per page of each chunk.
+        """
+
+        with self.tracer.span("align"):
+            input_ids = prepared_chunks["input_ids"]
+
+            # Convert token IDs of all chunks (without [CLS] and [SEP]) to text tokens in one call
+            content_lengths = [len(input_ids[i]) - 2 for i in chunk_indices]
+            all_tokenized_words = tokenizer.convert_ids_to_tokens([token_id for i in chunk_indices for token_id in input_ids[i][1:-1]])
+
+            results = []
+
+            # Align everything togther
+            # Iterate over each chunk
+            word_start = 0
+            for position, i in enumerate(chunk_indices):
+                tokenized_words = all_tokenized_words[word_start:word_start + content_lengths[position]]
+                word_start += content_lengths[position]
+
+                predictions_list = list(zip(tokenized_words, chunk_predictions[position], chunk_confidences[position]))
+                offsets_list = prepared_chunks["offsets"][i]
+
+                # One result per page of the chunk (packed chunks hold several pages)
+                span_start = 0
+                for page_no, token_count in prepared_chunks["page_spans"][i]:
+                    result = {}
+                    result["chunk_page_no"] = page_no
+                    result["is_overlapped"] = prepared_chunks["overlaps"][i]
+                    result["predictions"] = predictions_list[span_start:span_start + token_count]
+                    # Character offsets of the predicted tokens in the page text
+                    result["offsets"] = offsets_list[span_start:span_start + token_count]
+                    span_start += token_count
+
+                    results.append(result)
+
+            return results
+
+    def _plan_chunks(self, input_ids:list, model_id:str) -> dict:
+
+        """
+        Looks up the chunks in the page cache and finds the chunks which still need the model.
+
+        Returns the cache key of every chunk, the already known predictions by key and the indices
+        of the chunks to run. Repeated chunks of the document are run only once.
+        """
+
+        plan = {}
+        plan["keys"] = [chunk_key(model_id, chunk) for chunk in input_ids]
+        plan["resolved"] = {}
+        plan["run_indices"] = []
+
+        scheduled_keys = set()
+        cache_hits = 0
+        for chunk_index, key in enumerate(plan["keys"]):
+            if key in plan["resolved"] or key in scheduled_keys:
+                continue
+
+            cached = page_cache.get(key) if self.cache_pages else None
+            if cached is not None:
+                cache_hits += 1
+                plan["resolved"][key] = cached
+            else:
+                scheduled_keys.add(key)
+                plan["run_indices"].append(chunk_index)
+
+        self.cache_stats = {}
+        self.cache_stats["chunks"] = len(input_ids)
+        self.cache_stats["inferred"] = len(plan["run_indices"])
+        self.cache_stats["cached"] = sum(1 for key in plan["keys"] if key in plan["resolved"])
+        self.cache_stats["deduplicated"] = self.cache_stats["chunks"] - self.cache_stats["inferred"] - self.cache_stats["cached"]
+
+        print(f"----- {self.cache_stats['inferred']} OF {self.cache_stats['chunks']} CHUNKS NEED THE MODEL -----")
+        self.tracer.count("cached_chunks", self.cache_stats["cached"])
+        self.tracer.count("deduplicated_chunks", self.cache_stats["deduplicated"])
+        if self.cache_pages:
+            # Lookups of distinct chunks. Every miss runs through the model.
+            self.tracer.count("page_cache_hits", cache_hits)
+            self.tracer.count("page_cache_misses", self.cache_stats["inferred"])
+
+        return plan
+
+    def _resolve_chunks(self, plan:dict, chunk_indices:list, chunk_predictions:list, chunk_confidences:list) -> None:
+
+        # Remember the predictions of freshly predicted chunks for this document and for later documents
+        for chunk_index, predictions, confidences in zip(chunk_indices, chunk_predictions, chunk_confidences):
+            key = plan["keys"][chunk_index]
+            plan["resolved"][key] = (predictions, confidences)
+            if self.cache_pages:
+                self.tracer.count("page_cache_evictions", page_cache.put(key, predictions, confidences))
+
+    def _get_cascade_model(self, loaded_model):
+
+        if self.cascade_model_dir is None:
+            return None
+
+        # Same variant as the first model, so both run on the same device
+        cascade_model = model_registry.get(self.cascade_model_dir, quantize=self.quantize, backend=self.backend, precision=self.precision)
+        _check_cascade(loaded_model, cascade_model)
+
+        return cascade_model
+
+    def _get_prediction_id(self, loaded_model, cascade_model) -> str:
+
+        # Identity of the predictions in the page cache. Cascaded predictions depend on both models and the thresholds.
+        if cascade_model is None:
+            return loaded_model.model_id
+        return f"{loaded_model.model_id}>{cascade_model.model_id}@{self.cascade_threshold}-{self.cascade_max_uncertain}"
+
+    def _is_uncertain(self, confidences:list) -> bool:
+        num_uncertain = sum(1 for confidence in confidences if confidence < self.cascade_threshold)
+        return num_uncertain > self.cascade_max_uncertain * len(confidences)
+
+    def _escalate_uncertain(self, cascade_model, input_ids:list, chunk_predictions:list, chunk_confidences:list) -> None:
+
+        """
+        Predicts the uncertain chunks again with `cascade_model` and replaces their predictions and confidences in place.
+
+        `input_ids`, `chunk_predictions` and `chunk_confidences` are aligned lists of the same chunks.
+        """
+
+        uncertain_positions = [position for position, confidences in enumerate(chunk_confidences) if self._is_uncertain(confidences)]
+
+        self.cascade_stats["chunks"] = self.cascade_stats.get("chunks", 0) + len(input_ids)
+        self.cascade_stats["escalated"] = self.cascade_stats.get("escalated", 0) + len(uncertain_positions)
+        self.cascade_stats["escalated_fraction"] = self.cascade_stats["escalated"] / max(self.cascade_stats["chunks"], 1)
+        self.tracer.count("cascade_escalated_chunks", len(uncertain_positions))
+
+        if not uncertain_positions:
+            return
+
+        escalated_predictions = [None] * len(uncertain_positions)
+        escalated_confidences = [None] * len(uncertain_positions)
+        with self.tracer.span("cascade", chunks=len(uncertain_positions)):
+            for batch_positions, batch_predictions, batch_confidences in self._run_batches(cascade_model.runner, cascade_model.tokenizer, [input_ids[position] for position in uncertain_positions], cascade_model.device):
+                for position, predictions, confidences in zip(batch_positions, batch_predictions, batch_confidences):
+                    escalated_predictions[position] = predictions
+                    escalated_confidences[position] = confidences
+            escalated_predictions, escalated_confidences = self._to_host(escalated_predictions, escalated_confidences)
+
+        for position, predictions, confidences in zip(uncertain_positions, escalated_predictions, escalated_confidences):
+            chunk_predictions[position] = predictions
+            chunk_confidences[position] = confidences
+
+    def get_model_identity(self) -> dict:
+
+        """
+        Returns the identity of the model and of the inference options which change the predictions.
+
+        Used as part of the key of the extraction result cache. The fingerprint changes whenever the model folder changes.
+        """
+
+        identity = {}
+        identity["model_dir"] = self.model_dir
+        identity["fingerprint"] = model_fingerprint(self.model_dir)
+        identity["variant"] = f"{'int8' if self.quantize else self.precision}-{self.backend}{'-packed' if self.pack_pages else ''}{'-stripped' if self.strip_boilerplate else ''}{'-layouts' if self.parse_known_layouts else ''}"
+        if self.cascade_model_dir is not None:
+            identity["variant"] += f"-cascade@{model_fingerprint(self.cascade_model_dir)}-{self.cascade_threshold}-{self.cascade_max_uncertain}"
+
+        return identity
+
+    def extract_text_from_pdf(self):
+
+        pdf_text = {}
+        pdf_text["name"] = self.pdf_file_object.name
+        pdf_text["content"] = []
+
+        # getvalue() of the upload returns its buffer without another copy
+        file_bytes = self.pdf_file_object.getvalue()
+
+        # Pages before the module start page are skipped. Large documents are read by parallel workers.
+        first_page_index = 0 if self.module_start_page is None else max(self.module_start_page - 1, 0)
+        with self.tracer.span("read_pdf"):
+            page_texts = extract_page_texts(file_bytes, first_page_index, self.extraction_workers, as_lines=self.strip_boilerplate)
+
+        # Headers, footers and page numbers are removed using all pages read, so they are found in short module sections as well
+        if self.strip_boilerplate:
+            with self.tracer.span("strip_boilerplate"):
+                page_texts, page_removed_lines = BoilerplateDetector().strip(page_texts)
+
+        # Without a start page, only the module description pages reach the model
+        if self.module_start_page is None:
+            with self.tracer.span("detect_pages"):
+                page_indices = PageClassifier().find_module_pages(page_texts)
+            print(f"----- DETECTED MODULE PAGES {page_indices[0]+1} TO {page_indices[-1]+1} -----" if page_indices else "----- NO PAGES FOUND -----")
+        else:
+            page_indices = range(len(page_texts))
+
+        # Pages of known layouts are read from their tables. Only the text the tables do not hold goes to the model.
+        page_results = {}
+        if self.parse_known_layouts and len(page_indices):
+            with self.tracer.span("parse_layout"):
+                page_results = self._parse_known_layout(file_bytes, first_page_index, page_texts, page_indices)
+
+        for page_index in page_indices:
+            page_text = page_texts[page_index]
+            if page_index in page_results:
+                self.rule_extractions[first_page_index+page_index+1] = page_results[page_index]["extracted_text"]
+                page_text = page_results[page_index]["residual_text"]
+                if not page_text:
+                    continue
+
+            pdf_text["content"].append(
+                {
+                    first_page_index+page_index+1:page_text
+                }
+            )
+
+        # Only the lines removed from the pages which reach the model save tokens
+        if self.strip_boilerplate:
+            self.removed_lines = Counter(line for page_index in page_indices for line in page_removed_lines[page_index])
+
+        self.tracer.count("pages_read", len(page_texts))
+        self.tracer.count("pages", len(pdf_text["content"]))
+
+        return pdf_text
     
-            results["content"].append(result)
+    def _parse_known_layout(self, file_bytes:bytes, first_page_index:int, page_texts:list, page_indices:list) -> dict:
+
+        """
+        Parses the pages in `page_indices` if the document has a known layout. Returns the results of the parsed pages by page index.
+        """
+
+        layout_parser = LayoutParser()
+        layout = layout_parser.detect_layout([page_texts[page_index] for page_index in page_indices])
+        self.layout_stats["layout"] = layout
+        if layout is None:
+            return {}
+
+        # The module pages are contiguous
+        page_results = layout_parser.parse(file_bytes, layout, first_page_index + page_indices[0], first_page_index + page_indices[-1] + 1, self.extraction_workers)
+
+        parsed_results = {}
+        for page_index, page_result in zip(range(page_indices[0], page_indices[-1] + 1), page_results):
+            if page_result is not None:
+                parsed_results[page_index] = page_result
+
+        self.layout_stats["pages_parsed"] = len(parsed_results)
+        self.layout_stats["pages_with_residual_text"] = sum(1 for page_result in parsed_results.values() if page_result["residual_text"])
+        self.layout_stats["pages_to_model"] = len(page_indices) - len(parsed_results) + self.layout_stats["pages_with_residual_text"]
+        self.tracer.count("layout_pages_parsed", self.layout_stats["pages_parsed"])
+
+        print(f"----- PARSED {self.layout_stats['pages_parsed']} PAGES OF LAYOUT {layout.upper()}, {self.layout_stats['pages_to_model']} PAGES GO TO THE MODEL -----")
+
+        return parsed_results
+
+    def add_rule_extractions(self, extractions):
+
+        """
+        Merges the extractions of the pages parsed by `LayoutParser` into the extractions of the model and yields them in page order.
+
+        `extractions`: Grouped chunks (`pdf_page_no` and `extracted_text`) in page order, e.g. from `PostProcess.stream_extractions`.
+        Labels found by both are joined, the parsed text first.
+        """
+
+        rule_page_numbers = sorted(self.rule_extractions)
+        next_rule_page = 0
+        for chunk in extractions:
+            while next_rule_page < len(rule_page_numbers) and rule_page_numbers[next_rule_page] < chunk["pdf_page_no"]:
+                yield self._get_rule_chunk(rule_page_numbers[next_rule_page])
+                next_rule_page += 1
+
+            # The remaining text of a parsed page is merged into the first chunk of the page
+            if next_rule_page < len(rule_page_numbers) and rule_page_numbers[next_rule_page] == chunk["pdf_page_no"]:
+                extracted_text = dict(self.rule_extractions[chunk["pdf_page_no"]])
+                for label, text in chunk["extracted_text"].items():
+                    extracted_text[label] = extracted_text[label] + " " + text if label in extracted_text else text
+                chunk["extracted_text"] = extracted_text
+                next_rule_page += 1
+
+            yield chunk
+
+        for page_no in rule_page_numbers[next_rule_page:]:
+            yield self._get_rule_chunk(page_no)
+
+    def _get_rule_chunk(self, page_no:int) -> dict:
+        chunk = {}
+        chunk["pdf_page_no"] = page_no
+        chunk["extracted_text"] = dict(self.rule_extractions[page_no])
+        return chunk
+
+    def make_predictions(self, pdf_text:dict, prepared_chunks:dict=None):
+
+        """
+        Runs the model on the pages of `pdf_text` and returns the results of all chunks.
+
+        `prepared_chunks`: Optional result of `prepare_predictions` for `pdf_text`.
+        """
+
+        results = {}
+        results["name"] = pdf_text["name"]
+        results["content"] = []
+
+        # Get the model from the process-wide registry (loaded only once per process)
+        loaded_model = model_registry.get(self.model_dir, quantize=self.quantize, backend=self.backend, precision=self.precision)
+        runner = loaded_model.runner
+        tokenizer = loaded_model.tokenizer
+        device = loaded_model.device
+        cascade_model = self._get_cascade_model(loaded_model)
+
+        if prepared_chunks is None:
+            prepared_chunks = self._prepare_chunks(tokenizer, pdf_text)
+        num_chunks = len(prepared_chunks["input_ids"])
+
+        plan = self._plan_chunks(prepared_chunks["input_ids"], self._get_prediction_id(loaded_model, cascade_model))
+        run_indices = plan["run_indices"]
+
+        # Getting model predictions of the new chunks in memory-bounded, length-bucketed batches
+        run_predictions = [None] * len(run_indices)
+        run_confidences = [None] * len(run_indices)
+        with self.tracer.profile("inference"):
+            for batch_positions, batch_predictions, batch_confidences in self._run_batches(runner, tokenizer, [prepared_chunks["input_ids"][i] for i in run_indices], device):
+                # Restore the original chunk order
+                for position, predictions, confidences in zip(batch_positions, batch_predictions, batch_confidences):
+                    run_predictions[position] = predictions
+                    run_confidences[position] = confidences
+
+            # One transfer from the device to the host for the whole document
+            run_predictions, run_confidences = self._to_host(run_predictions, run_confidences)
+
+            # Uncertain chunks are predicted again by the larger model
+            if cascade_model is not None:
+                self._escalate_uncertain(cascade_model, [prepared_chunks["input_ids"][i] for i in run_indices], run_predictions, run_confidences)
+        self._resolve_chunks(plan, run_indices, run_predictions, run_confidences)
+
+        chunk_predictions = [plan["resolved"][key][0] for key in plan["keys"]]
+        chunk_confidences = [plan["resolved"][key][1] for key in plan["keys"]]
+
+        results["content"] = self._build_results(tokenizer, prepared_chunks, list(range(num_chunks)), chunk_predictions, chunk_confidences)
     
-        return results
\ No newline at end of file
+        return results
+
+    def prepare_predictions(self, pdf_text:dict) -> dict:
+
+        """
+        Tokenizes and chunks the pages of `pdf_text` without running the model.
+
+        Pass the result to `stream_predictions`, so the tokenization of one file can overlap with the inference of another.
+        """
+
+        loaded_model = model_registry.get(self.model_dir, quantize=self.quantize, backend=self.backend, precision=self.precision)
+        return self._prepare_chunks(loaded_model.tokenizer, pdf_text)
+
+    def stream_predictions(self, pdf_text:dict, prepared_chunks:dict=None):
+
+        """
+        Streaming variant of `make_predictions`.
+
+        Runs the batches in document order and yields the list of results of every batch as soon as it is done,
+        so post-processing (see `PostProcess.stream_extractions`) can start before the whole document is predicted.
+
+        `prepared_chunks`: Optional result of `prepare_predictions` for `pdf_text`.
+        """
+
+        # Get the model from the process-wide registry (loaded only once per process)
+        loaded_model = model_registry.get(self.model_dir, quantize=self.quantize, backend=self.backend, precision=self.precision)
+        runner = loaded_model.runner
+        tokenizer = loaded_model.tokenizer
+        device = loaded_model.device
+        cascade_model = self._get_cascade_model(loaded_model)
+
+        if prepared_chunks is None:
+            prepared_chunks = self._prepare_chunks(tokenizer, pdf_text)
+        plan = self._plan_chunks(prepared_chunks["input_ids"], self._get_prediction_id(loaded_model, cascade_model))
+        run_indices = plan["run_indices"]
+        num_chunks = len(plan["keys"])
+
+        # Yield every chunk in document order as soon as its predictions are known
+        next_chunk = 0
+        def ready_chunks():
+            nonlocal next_chunk
+            start = next_chunk
+            while next_chunk < num_chunks and plan["keys"][next_chunk] in plan["resolved"]:
+                next_chunk += 1
+            return list(range(start, next_chunk))
+
+        def build_ready_results(chunk_indices):
+            chunk_predictions = [plan["resolved"][plan["keys"][i]][0] for i in chunk_indices]
+            chunk_confidences = [plan["resolved"][plan["keys"][i]][1] for i in chunk_indices]
+            return self._build_results(tokenizer, prepared_chunks, chunk_indices, chunk_predictions, chunk_confidences)
+
+        # Cached chunks at the start of the document do not wait for the model
+        chunk_indices = ready_chunks()
+        if chunk_indices:
+            yield build_ready_results(chunk_indices)
+
+        for batch_positions, batch_predictions, batch_confidences in self._run_batches(runner, tokenizer, [prepared_chunks["input_ids"][i] for i in run_indices], device, sort_by_length=False):
+            chunk_predictions, chunk_confidences = self._to_host(batch_predictions, batch_confidences)
+            if cascade_model is not None:
+                self._escalate_uncertain(cascade_model, [prepared_chunks["input_ids"][run_indices[position]] for position in batch_positions], chunk_predictions, chunk_confidences)
+            self._resolve_chunks(plan, [run_indices[position] for position in batch_positions], chunk_predictions, chunk_confidences)
+
+            chunk_indices = ready_chunks()
+            if chunk_indices:
+                yield build_ready_results(chunk_indices)
@@ -0,0 +1,217 @@
+# Lightweight instrumentation of the extraction pipeline.
+# A Tracer records timed spans and counters of one extraction, so slow extractions can be traced back to
+# the PDF reader, the tokenizer, the forward pass or the post-processing loops.
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Only available on Unix. On Windows the peak memory is read with psutil if it is installed.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def get_peak_rss_mb() -> float | None:
+
+    """
+    Returns the peak resident memory of the process so far in MB, or `None` if it cannot be measured on this platform.
+    """
+
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+    try:
+        import psutil
+        memory_info = psutil.Process().memory_info()
+    except Exception:
+        return None
+
+    # peak_wset is the peak working set on Windows
+    return getattr(memory_info, "peak_wset", memory_info.rss) / (1024 * 1024)
+
+def get_current_rss_mb() -> float | None:
+
+    """
+    Returns the current resident memory of the process in MB, or `None` if it cannot be measured on this platform.
+    """
+
+    # The second field of statm is the number of resident pages (Linux only)
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+def _get_cuda_peak_mb() -> float | None:
+
+    # Only if torch is already imported, so the PDF reader workers do not import it
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated() / (1024 * 1024)
+
+class Tracer:
+
+    """
+    Records spans (named, timed sections) and counters of one extraction.
+
+    `name`: Name of the traced extraction, e.g. the file name.
+
+    `enabled`: A disabled tracer records nothing and costs next to nothing.
+
+    `profile_dir`: Optional folder for torch profiler traces of the spans opened with `profile`. Open them in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, name:str="extraction", enabled:bool=True, profile_dir:str=None):
+        self.name = name
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.spans = []
+        self.counters = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name:str, **attributes):
+
+        """
+        Measures the duration of the code inside the `with` block. Nested spans are recorded on their own.
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        # The peak RSS only grows over the life of the process, so the memory of a span is the change of the current RSS
+        start_rss_mb = get_current_rss_mb()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            span = {}
+            span["name"] = name
+            span["start"] = start_time
+            span["seconds"] = time.perf_counter() - start_time
+            end_rss_mb = get_current_rss_mb()
+            if start_rss_mb is not None and end_rss_mb is not None:
+                span["rss_mb"] = end_rss_mb
+                span["rss_delta_mb"] = end_rss_mb - start_rss_mb
+            cuda_peak_mb = _get_cuda_peak_mb()
+            if cuda_peak_mb is not None:
+                span["cuda_peak_mb"] = cuda_peak_mb
+            span.update(attributes)
+
+            with self._lock:
+                self.spans.append(span)
+
+    def profile(self, name:str):
+
+        """
+        Span which is also captured by the torch profiler if a `profile_dir` is set.
+        """
+
+        if not self.enabled or self.profile_dir is None:
+            return self.span(name)
+        return self._profile(name)
+
+    @contextmanager
+    def _profile(self, name:str):
+
+        import torch
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        with self.span(name):
+            with torch.profiler.profile(activities=activities, record_shapes=True) as profiler:
+                yield
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        trace_path = os.path.join(self.profile_dir, f"{os.path.splitext(self.name)[0]}_{name}_{int(self.started_at)}.json")
+        profiler.export_chrome_trace(trace_path)
+        self.count("profiler_traces")
+
+    def count(self, name:str, value:int=1) -> None:
+
+        """
+        Adds `value` to the counter `name`.
+        """
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_stage_seconds(self) -> dict:
+
+        """
+        Returns the total duration of every span name.
+        """
+
+        with self._lock:
+            stage_seconds = {}
+            for span in self.spans:
+                stage_seconds[span["name"]] = stage_seconds.get(span["name"], 0.0) + span["seconds"]
+
+        return stage_seconds
+
+    def summary(self) -> dict:
+
+        """
+        Returns the total duration, number of calls and change of the resident memory of every span name, all counters,
+        and the peak resident memory of the process.
+        """
+
+        with self._lock:
+            stages = {}
+            for span in self.spans:
+                stage = stages.setdefault(span["name"], {"seconds": 0.0, "calls": 0})
+                stage["seconds"] += span["seconds"]
+                stage["calls"] += 1
+                if "rss_delta_mb" in span:
+                    stage["rss_delta_mb"] = stage.get("rss_delta_mb", 0.0) + span["rss_delta_mb"]
+                    stage["max_rss_mb"] = max(stage.get("max_rss_mb", 0.0), span["rss_mb"])
+                if "cuda_peak_mb" in span:
+                    stage["cuda_peak_mb"] = max(stage.get("cuda_peak_mb", 0.0), span["cuda_peak_mb"])
+
+            summary = {}
+            summary["name"] = self.name
+            summary["started_at"] = self.started_at
+            summary["stages"] = stages
+            summary["counters"] = dict(self.counters)
+            summary["process_peak_rss_mb"] = get_peak_rss_mb()
+
+        return summary
+
+    def export_jsonl(self, path:str, include_spans:bool=False) -> None:
+
+        """
+        Appends the summary (and optionally every span) of the extraction to a JSON lines file.
+        """
+
+        if not self.enabled:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as metrics_file:
+            if include_spans:
+                for span in list(self.spans):
+                    metrics_file.write(json.dumps({"type": "span", "extraction": self.name, **span}) + "\n")
+            metrics_file.write(json.dumps({"type": "summary", **self.summary()}) + "\n")
+
+# Used wherever no tracer is passed
+null_tracer = Tracer("null", enabled=False)
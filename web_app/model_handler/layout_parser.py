@@ -0,0 +1,319 @@
+# Rule-based extraction for the module handbook layouts which the dataset was built from (see dataset_creator/text_extractor.py).
+# Their module descriptions are tables of tag/content cells, so the labels can be read from the tables exactly,
+# without running the transformer. Text which the tables do not hold is left for the model.
+# Like pdf_reader.py, it only depends on pymupdf, so the tables can be read in the worker processes.
+
+import re
+import pymupdf
+from .page_classifier import label_map
+from .boilerplate import BoilerplateDetector
+from .pdf_reader import map_pages
+
+number_pattern = re.compile(r"\d+(\.\d+)*")
+
+# Known layouts. `signature`: keywords which are found on the module pages of the layout.
+# `tags`: tags of the layout which are not in `label_map` (same as in TextExtractor). They are recognized, but not extracted.
+# `tag_column`: The tag is the first cell of a row and the content the other cells (otherwise every cell holds "tag\ncontent").
+# `skip_cells`: Cells which are neither a tag nor content.
+# `title_tag`: Tag for the untagged cells of the first row of a table (the module name in Bonn handbooks).
+LAYOUTS = {
+    "tu_darmstadt": {
+        "university": "Technical University Darmstadt",
+        "signature": ["Modul Nr.", "Modulverantwortliche Person", "Lerninhalt"],
+        "tags": [],
+        "tag_column": False,
+        "skip_cells": ["Enthaltene Kurse"],
+        "title_tag": None
+    },
+    "h_da": {
+        "university": "Hochschule Darmstadt",
+        "signature": ["Modulkürzel", "Lehrveranstaltung", "Arbeitsaufwand und Credit Points"],
+        "tags": [],
+        "tag_column": False,
+        "skip_cells": [],
+        "title_tag": None
+    },
+    "uni_bonn": {
+        "university": "University of Bonn",
+        "signature": ["Person in Charge", "Learning Targets", "Instructors"],
+        "tags": ["Credit Points", "Offered", "Usability", "Courses", "Type, Topic", "h/week", "Workload (hours)", "CP", "More Information"],
+        "tag_column": True,
+        "skip_cells": [],
+        "title_tag": "Module Name"
+    },
+    "uni_kiel": {
+        "university": "University of Kiel",
+        "signature": ["Module description", "Module code", "Lecturer responsible for the module"],
+        "tags": ["Abbreviation if applicable", "Subtitle, if applicable", "Courses", "Compulsory/ optional", "Compulsory/optional", "Graded/not graded", "Weighting", "Coursework", "Media forms"],
+        "tag_column": True,
+        "skip_cells": [],
+        "title_tag": None
+    },
+    "rwth_aachen": {
+        "university": "RWTH Aachen University",
+        "signature": ["Module titel", "Identifier", "Cycle (Semester)"],
+        "tags": ["Version", "Valid from", "Valid until", "Miscellaneous"],
+        "tag_column": True,
+        "skip_cells": [],
+        "title_tag": None
+    }
+}
+
+def normalize(text:str) -> str:
+    return " ".join(text.split())
+
+def _get_tag_key(text:str) -> str:
+
+    # Tags are compared with normalized white space and without a trailing colon ("Workload:" in Bonn handbooks)
+    return normalize(text).rstrip(":").rstrip()
+
+# Standard label of every tag of label_map
+label_for_tag = {}
+for label, keywords in label_map.items():
+    for keyword in keywords:
+        label_for_tag[_get_tag_key(keyword)] = label
+
+for layout_info in LAYOUTS.values():
+    layout_info["tag_keys"] = set(_get_tag_key(tag) for tag in layout_info["tags"])
+
+def get_page_tables(page) -> dict:
+
+    """
+    Returns the rows of the tables of a page and the lines of the page outside the tables.
+    """
+
+    tables = page.find_tables().tables
+    table_boxes = [pymupdf.Rect(table.bbox) for table in tables]
+
+    # Words are grouped into their lines. A word belongs to a table if its center is inside the table.
+    outside_lines = {}
+    for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words"):
+        center = pymupdf.Point((x0 + x1) / 2, (y0 + y1) / 2)
+        if not any(box.contains(center) for box in table_boxes):
+            outside_lines.setdefault((block_no, line_no), []).append(word)
+
+    page_tables = {}
+    page_tables["tables"] = [table.extract() for table in tables]
+    page_tables["outside_lines"] = [" ".join(words) for words in outside_lines.values()]
+
+    return page_tables
+
+class LayoutParser:
+
+    """
+    Detects the known handbook layouts and reads the labels of their module pages from the tables.
+
+    Every tag of a table which is in `label_map` becomes a label of the extraction, with the tag and its content as text,
+    the same text the model was trained to label.
+
+    `min_pages`: Number of pages each signature keyword of a layout must be found on to detect it.
+
+    Text outside the tables of a parsed page (after removing running headers and footers) is passed to the model,
+    however short it is (e.g. the name of a module above its table).
+
+    `edge_lines`: Number of lines at the top and at the bottom of a page (outside the tables) which are checked for running headers and footers.
+    """
+
+    def __init__(self, min_pages:int=3, edge_lines:int=3):
+        self.min_pages = min_pages
+        self.edge_lines = edge_lines
+
+    def detect_layout(self, page_texts:list) -> str | None:
+
+        """
+        Returns the known layout whose signature keywords are found on the most pages, or `None`.
+
+        `page_texts`: Texts of the pages with normalized white space.
+        """
+
+        # A module description spans several pages, so every keyword is counted on its own
+        page_counts = {}
+        for layout, layout_info in LAYOUTS.items():
+            page_counts[layout] = min(sum(1 for page_text in page_texts if keyword in page_text) for keyword in layout_info["signature"])
+
+        layout = max(page_counts, key=page_counts.get)
+        if page_counts[layout] < self.min_pages:
+            return None
+
+        return layout
+
+    def _is_tag(self, text:str, layout_info:dict) -> bool:
+        tag_key = _get_tag_key(text)
+        return tag_key in label_for_tag or tag_key in layout_info["tag_keys"]
+
+    def _split_tag(self, cell:str, layout_info:dict) -> tuple | None:
+
+        # Returns (tag, content) of a "tag\ncontent" cell. Tags may span several lines themselves.
+        lines = cell.split("\n")
+        for num_lines in range(1, min(len(lines), 4)):
+            tag = " ".join(lines[:num_lines])
+            if self._is_tag(tag, layout_info):
+                return (tag, "\n".join(lines[num_lines:]))
+
+        return None
+
+    def _parse_cells(self, cells:list, layout_info:dict, is_title_row:bool) -> list:
+
+        # Every cell is "tag\ncontent", a tag alone, or content which continues the previous tag
+        entries = []
+        for cell_index, cell in enumerate(cells):
+            if cell_index == 0 and number_pattern.fullmatch(cell.strip()):
+                continue
+            if not cell.strip() or normalize(cell) in layout_info["skip_cells"]:
+                continue
+
+            if self._is_tag(cell, layout_info):
+                entries.append((cell, ""))
+                continue
+
+            tag_and_content = self._split_tag(cell, layout_info)
+            if tag_and_content is not None:
+                entries.append(tag_and_content)
+            elif is_title_row and layout_info["title_tag"] is not None:
+                # The module name has no tag of its own, so its text is extracted without one
+                entries.append((layout_info["title_tag"], None, cell))
+            else:
+                entries.append((None, cell))
+
+        return entries
+
+    def _parse_table(self, rows:list, layout_info:dict) -> list:
+
+        """
+        Returns the entries of the rows of a table in reading order.
+
+        An entry is `(tag, content)`, `(None, content)` for content which continues the previous tag,
+        or `(tag, None, text)` for text which is extracted without its tag.
+        """
+
+        entries = []
+        header = None
+        for row_index, row in enumerate(rows):
+            cells = [cell for cell in row if cell is not None]
+            if not any(cell.strip() for cell in cells):
+                continue
+
+            first_cell = cells[0]
+
+            # Rows below a header row hold one value per column (courses, exams, usability)
+            if header is not None and not (first_cell.strip() and self._is_tag(first_cell, layout_info)) and len(row) == len(header):
+                for tag, value in zip(header, row):
+                    if tag and value and value.strip():
+                        entries.append((tag, value))
+                continue
+            header = None
+
+            filled_cells = [cell for cell in cells if cell.strip()]
+            if len(filled_cells) >= 3 and all(self._is_tag(cell, layout_info) for cell in filled_cells):
+                header = row
+                continue
+
+            if not layout_info["tag_column"]:
+                entries.extend(self._parse_cells(cells, layout_info, row_index == 0))
+            elif not first_cell.strip():
+                entries.append((None, " ".join(cells[1:])))
+            elif self._is_tag(first_cell, layout_info):
+                entries.append((first_cell, " ".join(cells[1:])))
+            elif self._split_tag(first_cell, layout_info) is not None:
+                entries.extend(self._parse_cells(cells, layout_info, row_index == 0))
+            elif row_index == 0:
+                # Repeated title row of a module which continues from the previous page (RWTH handbooks)
+                continue
+            else:
+                # Tags of the first column which are not known are not extracted, but end the previous tag
+                entries.append((first_cell, " ".join(cells[1:])))
+
+        return entries
+
+    def parse_page(self, page_tables:dict, layout:str, previous_tag:str=None) -> tuple:
+
+        """
+        Reads the labels of one page from its tables.
+
+        `previous_tag`: Last tag of the previous page, which content at the top of the page continues.
+        `None` if the previous page was not parsed.
+
+        Returns the extracted text by label, the content which could not be attributed to a tag, and the last tag of the page.
+        """
+
+        layout_info = LAYOUTS[layout]
+
+        extracted_text = {}
+        unattributed = []
+        current_tag = previous_tag
+        for rows in page_tables["tables"]:
+            for entry in self._parse_table(rows, layout_info):
+                if entry[0] is None:
+                    if current_tag is None:
+                        unattributed.append(normalize(entry[1]))
+                        continue
+                    tag, text = current_tag, normalize(entry[1])
+                elif len(entry) == 3:
+                    tag, text = entry[0], normalize(entry[2])
+                    current_tag = tag
+                else:
+                    tag, text = entry[0], normalize(f"{entry[0]} {entry[1]}")
+                    current_tag = tag
+
+                label = label_for_tag.get(_get_tag_key(tag))
+                if label is None or not text:
+                    continue
+                if label not in extracted_text:
+                    extracted_text[label] = text
+                else:
+                    extracted_text[label] = extracted_text[label] + " " + text
+
+        return (extracted_text, unattributed, current_tag)
+
+    def _is_edge_line(self, line_index:int, num_lines:int) -> bool:
+        return line_index < self.edge_lines or line_index >= num_lines - self.edge_lines
+
+    def _strip_running_lines(self, pages_lines:list) -> list:
+
+        # Running headers with the name of the module repeat on the pages of one module only, so they are found
+        # at the top or bottom of the adjacent pages. Repeated lines between the tables (e.g. notes) are kept.
+        edge_lines = [set(line for line_index, line in enumerate(page_lines) if self._is_edge_line(line_index, len(page_lines))) for page_lines in pages_lines]
+
+        stripped_lines = []
+        for page_index, page_lines in enumerate(pages_lines):
+            neighbour_lines = set()
+            if page_index > 0:
+                neighbour_lines |= edge_lines[page_index - 1]
+            if page_index + 1 < len(pages_lines):
+                neighbour_lines |= edge_lines[page_index + 1]
+
+            stripped_lines.append([line for line_index, line in enumerate(page_lines) if not (self._is_edge_line(line_index, len(page_lines)) and line in neighbour_lines)])
+
+        return stripped_lines
+
+    def parse(self, file_bytes:bytes, layout:str, first_page_index:int, stop_page_index:int, max_workers:int=None) -> list:
+
+        """
+        Parses the pages from `first_page_index` up to `stop_page_index` (0-based) of the PDF document in `file_bytes`.
+
+        Returns one result per page: `None` if no label was found in the tables of the page, which then goes to the model as it is,
+        otherwise the extracted text by label and the remaining text for the model (`""` if nothing is left).
+        """
+
+        pages_tables = map_pages(file_bytes, get_page_tables, first_page_index, stop_page_index, max_workers)
+        pages_lines = self._strip_running_lines([page_tables["outside_lines"] for page_tables in pages_tables])
+
+        # Running headers, footers and page numbers of the whole document are found on the pages outside the tables as well
+        residual_texts, _ = BoilerplateDetector().strip(pages_lines)
+
+        page_results = []
+        previous_tag = None
+        for page_tables, residual_text in zip(pages_tables, residual_texts):
+            extracted_text, unattributed, last_tag = self.parse_page(page_tables, layout, previous_tag)
+            if not extracted_text:
+                page_results.append(None)
+                previous_tag = None
+                continue
+
+            page_result = {}
+            page_result["extracted_text"] = extracted_text
+            page_result["residual_text"] = " ".join(unattributed + [residual_text]).strip()
+            page_results.append(page_result)
+            previous_tag = last_tag
+
+        return page_results
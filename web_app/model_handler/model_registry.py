@@ -0,0 +1,192 @@
+# This module keeps the fine-tuned models and their tokenizers in memory.
+# Models are loaded once per server process and shared by all sessions.
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+from transformers import AutoTokenizer
+from .backends import load_backend, get_device, resolve_precision
+
+def model_fingerprint(model_dir:str) -> str:
+
+    """
+    Returns a short fingerprint (version) of a model directory.
+
+    The fingerprint is built from the names, sizes and modification times of the files
+    in the directory, so saving a new checkpoint into the same folder changes it.
+
+    `model_dir`: Path to the folder which holds the model and tokenizer files.
+    """
+
+    hasher = hashlib.sha256()
+    for entry in sorted(os.scandir(model_dir), key=lambda entry: entry.name):
+        if entry.is_file():
+            stat = entry.stat()
+            hasher.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+
+    return hasher.hexdigest()[:16]
+
+def model_size_bytes(model) -> int:
+
+    """
+    Returns the size of all tensors in the state dict of `model`.
+
+    Works for quantized models as well, whose packed Linear weights are not part of `model.parameters()`.
+    """
+
+    size_bytes = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, tuple) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                size_bytes += tensor.numel() * tensor.element_size()
+
+    return size_bytes
+
+class LoadedModel:
+
+    """
+    A model and tokenizer pair which is resident in memory.
+
+    `runner`: The inference backend. Call it as `runner(input_ids, attention_mask)` to get the logits.
+    """
+
+    def __init__(self, model_dir:str, fingerprint:str, runner, tokenizer, device, quantize:bool=False, backend:str="eager", precision:str="fp32"):
+        self.model_dir = model_dir
+        self.fingerprint = fingerprint
+        self.runner = runner
+        self.model = runner.model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.quantize = quantize
+        self.backend = backend
+        self.precision = precision
+
+        # Size of the weights, used for the memory budget of the registry
+        self.size_bytes = runner.size_bytes if runner.size_bytes is not None else model_size_bytes(runner.model)
+
+    @property
+    def model_id(self) -> str:
+
+        """
+        Identity of the model as used for caching results, e.g. `model@3f2a...-int8-eager`
+        """
+
+        return f"{os.path.basename(self.model_dir)}@{self.fingerprint}-{'int8' if self.quantize else self.precision}-{self.backend}"
+
+class ModelRegistry:
+
+    """
+    Process-wide registry of loaded models.
+
+    Models are keyed by their directory, fingerprint and variant (fp32, bf16 or int8 and backend), so several checkpoints
+    (e.g. the bert-v4 and distilbert-v6 fine-tunes) can stay resident at the same time.
+    When the total size of the loaded models exceeds `memory_budget_mb`, the least
+    recently used models are evicted.
+    """
+
+    def __init__(self, memory_budget_mb:int=4096):
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, model_dir:str, fingerprint:str, quantize:bool, backend:str, precision:str) -> LoadedModel:
+
+        print(f"----- LOADING {'QUANTIZED ' if quantize else ''}MODEL FROM {model_dir} ({backend.upper()} BACKEND, {'INT8' if quantize else precision.upper()}) -----")
+
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        device = get_device(quantize, backend)
+        runner = load_backend(backend, model_dir, fingerprint, device, quantize, precision)
+
+        return LoadedModel(model_dir, fingerprint, runner, tokenizer, device, quantize, backend, precision)
+
+    def _evict(self, keep_key:tuple) -> None:
+
+        # Drop least recently used models until the budget is met. The requested model is always kept.
+        while self.memory_used_bytes() > self.memory_budget_bytes and len(self._models) > 1:
+            oldest_key = next(iter(self._models))
+            if oldest_key == keep_key:
+                self._models.move_to_end(oldest_key)
+                continue
+            evicted = self._models.pop(oldest_key)
+            print(f"----- EVICTED MODEL {evicted.model_id} -----")
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def get(self, model_dir:str="./model", quantize:bool=False, backend:str="eager", precision:str="fp32") -> LoadedModel:
+
+        """
+        Returns the `LoadedModel` for `model_dir`, loading it on first use.
+
+        `quantize`: Return the dynamically int8 quantized variant of the model (CPU only).
+
+        `backend`: Inference backend, one of `eager`, `compile`, `torchscript` or `onnx`.
+
+        `precision`: `fp32`, `bf16` or `auto`. bf16 falls back to fp32 on devices without native bf16 support.
+
+        If the files in `model_dir` changed since the model was loaded, the stale
+        model is dropped and the new checkpoint is loaded.
+        """
+
+        model_dir = os.path.abspath(model_dir)
+        fingerprint = model_fingerprint(model_dir)
+        # The callers resolve the precision themselves and report the bf16 fallback
+        precision = resolve_precision(precision, quantize, backend, verbose=False)
+        key = (model_dir, fingerprint, quantize, backend, precision)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            # Drop older versions of the same directory
+            for stale_key in [k for k in self._models if k[0] == model_dir and k[1] != fingerprint]:
+                del self._models[stale_key]
+
+            loaded_model = self._load(model_dir, fingerprint, quantize, backend, precision)
+            self._models[key] = loaded_model
+            self._evict(keep_key=key)
+
+            return loaded_model
+
+    def warm(self, model_dirs:list) -> None:
+
+        """
+        Loads all models in `model_dirs` so that the first extraction does not pay the cold start.
+        """
+
+        for model_dir in model_dirs:
+            if os.path.isdir(model_dir):
+                self.get(model_dir)
+            else:
+                print(f"Model directory {model_dir} does not exist. Skipping warm-up.")
+
+    def evict(self, model_dir:str) -> None:
+
+        """
+        Removes every version of the model in `model_dir` from the registry.
+        """
+
+        model_dir = os.path.abspath(model_dir)
+        with self._lock:
+            for key in [k for k in self._models if k[0] == model_dir]:
+                del self._models[key]
+
+    def memory_used_bytes(self) -> int:
+        return sum(loaded_model.size_bytes for loaded_model in self._models.values())
+
+    def loaded_models(self) -> list:
+
+        """
+        Returns `(model_id, size_mb)` for every resident model, least recently used first.
+        """
+
+        with self._lock:
+            return [(m.model_id, round(m.size_bytes / (1024 * 1024), 1)) for m in self._models.values()]
+
+# The registry shared by the whole server process
+model_registry = ModelRegistry()
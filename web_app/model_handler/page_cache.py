@@ -0,0 +1,109 @@
+# In-memory cache of the model predictions for single chunks of page tokens.
+# Revised handbooks and boilerplate pages repeat chunks which were already predicted, so only new chunks reach the model.
+
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+def chunk_key(model_id:str, input_ids:list) -> tuple:
+
+    """
+    Returns the cache key of a chunk: the model identity and a hash of the token IDs of the chunk.
+    """
+
+    return (model_id, hashlib.sha256(array("l", input_ids).tobytes()).hexdigest())
+
+class PageCache:
+
+    """
+    Size-bounded LRU cache of the label IDs and confidences of predicted chunks.
+
+    Values are stored as compact arrays (2 bytes per label ID, 4 bytes per confidence).
+
+    Entries are chunks, not pages. A page which has a chunk of its own hits as long as its tokens do not change.
+    With `pack_pages`, several short pages share a chunk, so such a page misses whenever a page packed with it changes.
+
+    `max_size_mb`: Size limit of the stored predictions. The least recently used chunks are removed first.
+    """
+
+    def __init__(self, max_size_mb:int=64):
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key:tuple) -> tuple | None:
+
+        """
+        Returns `(predictions, confidences)` of a cached chunk as lists or `None`.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return (entry[0].tolist(), entry[1].tolist())
+
+    def put(self, key:tuple, predictions:list, confidences:list) -> int:
+
+        """
+        Stores the predictions of a chunk. Returns the number of chunks evicted to make room for it.
+        """
+
+        entry = (array("H", predictions), array("f", confidences))
+        entry_size = len(entry[0]) * entry[0].itemsize + len(entry[1]) * entry[1].itemsize
+
+        with self._lock:
+            if key in self._entries:
+                return 0
+
+            self._entries[key] = entry
+            self.size_bytes += entry_size
+
+            # Remove the least recently used chunks
+            evicted = 0
+            while self.size_bytes > self.max_size_bytes and self._entries:
+                _, (old_predictions, old_confidences) = self._entries.popitem(last=False)
+                self.size_bytes -= len(old_predictions) * old_predictions.itemsize + len(old_confidences) * old_confidences.itemsize
+                evicted += 1
+            self.evictions += evicted
+
+        return evicted
+
+    def stats(self) -> dict:
+
+        """
+        Returns the hit/miss/eviction statistics of the cache since it was created or cleared.
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {}
+            stats["entries"] = len(self._entries)
+            stats["size_mb"] = self.size_bytes / (1024 * 1024)
+            stats["hits"] = self.hits
+            stats["misses"] = self.misses
+            stats["evictions"] = self.evictions
+            stats["hit_rate"] = self.hits / lookups if lookups else 0.0
+
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+# The cache shared by the whole server process
+page_cache = PageCache()
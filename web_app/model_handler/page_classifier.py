@@ -0,0 +1,83 @@
+# Cheap detection of module description pages, so front matter (title, table of contents, regulations)
+# and back matter never reach the transformer. Used when the module start page is not given.
+
+import re
+
+# Label keywords of the module handbooks (same as dataset_creator.utilities.label_map)
+label_map = {
+    "MODULE_NAME": ["Modulname", "Lehrveranstaltung", "Teilmodulname", "Module description", "Module Name", "Module titel"],
+    "MODULE_NR": ["Modul Nr.", "Modulkürzel", "Teilmodulkürzel", "Module code", "Module", "Identifier"],
+    "MODULE_TYPE": ["Art", "Mode", "Module level"],
+    "MODULE_CREDITS": ["Leistungspunkte", "ECTS credit points", "ECTS Credits"],
+    "MODULE_SEMESTER": ["Semester", "Where in the curriculum", "Recommended\nSemester (Study\nstart winter)", "Recommended\nSemester (Study\nstart summer)"],
+    "MODULE_HOURS": ["Arbeitsaufwand", "Arbeitsaufwand und Credit Points", "Workload", "Contact time (WSH)", "Total hours (h)", "Contact hours (h)"],
+    "MODULE_SELF_STUDY_HOURS": ["Selbststudium", "Self-study hours (h)"],
+    "MODULE_DURATION": ["Moduldauer", "Dauer, zeitliche Gliederung und Häufigkeit des Angebots", "Duration", "Duration (Semester)"],
+    "MODULE_SEM_TYPE": ["Angebotsturnus", "Repetition in the academic\nyear", "Cycle (Semester)"],
+    "MODULE_LANGUAGE": ["Sprache", "Lehrsprache", "Language"],
+    "MODULE_MANAGER": ["Modulverantwortliche Person", "Modulverantwortliche(r)", "Teilmodulverantwortliche(r)", "Lecturer responsible for the\nmodule", "Person in Charge", "Module coordinator"],
+    "MODULE_CONTENT": ["Lerninhalt", "Inhalt", "Contents", "Content"],
+    "MODULE_OUTCOMES": ["Qualifikationsziele / Lernergebnisse", "Ziele", "Learning objectives /\ncompetences", "Learning Targets", "Learning Objectives/\nLearning Outcomes"],
+    "MODULE_PREREQUISITES": ["Empfohlene Voraussetzungen für die Teilnahme", "Notwendige Kenntnisse", "Empfohlene Kenntnisse", "Recommended requirements", "Prerequisites", "(Study-Specific)\nPrerequisites", "(recommended)\nRequirements"],
+    "MODULE_TEACH_LEARN_METHODS": ["Lehr- und Lernformen"],
+    "MODULE_EXAM_FORMAT": ["Prüfungsform", "Prüfungsform, Prüfungsdauer und Prüfungsvoraussetzung", "Examinations", "Examination", "Examination duration (min)"],
+    "MODULE_PASSING_CRETERIA": ["BestehenderModulabschlussprüfung", "Voraussetzung für die Vergabe von Leistungspunkten", "Requirements according to\nthe Examination Regulations", "Further Required\nQualifications", "Requirements for\nExamination", "Examination Terms"],
+    "MODULE_GRADING": ["Benotung", "Assessment"],
+    "MODULE_DEGREE_PROGRAM": ["Verwendbarkeit des Moduls", "Studiengangsniveau", "Applicability of the module", "Program"],
+    "MODULE_GRADE_IMPROVEMENT": ["Notenverbesserung nach §25 (2)"],
+    "MODULE_LITERATURE": ["Literatur", "Literature", "References"],
+    "COURSE_NAME": ["Kursname", "Title"],
+    "COURSE_NR": ["Kurs-Nr."],
+    "MODULE_INSTRUCTOR": ["Dozent/in", "Weitere Lehrende", "Lecturer", "Instructors"],
+    "COURSE_TEACHING_FORM": ["Lehrform", "Type"],
+    "COURSE_SWS": ["SWS"],
+    "MODULE_FACULTY": ["Faculty responsible for the\nmodule"],
+    "MODULE_SCHOOL": ["Institute responsible for the\nmodule"]
+}
+
+def _compile_label_patterns(label_map:dict) -> dict:
+
+    # One pattern per label. Page texts have normalized white space, so the keywords get it too.
+    label_patterns = {}
+    for label, keywords in label_map.items():
+        alternatives = [re.escape(" ".join(keyword.split())) for keyword in keywords]
+        label_patterns[label] = re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)")
+
+    return label_patterns
+
+label_patterns = _compile_label_patterns(label_map)
+
+class PageClassifier:
+
+    """
+    Flags module description pages by the number of different label keywords found on a page.
+
+    A module description is a table of label/value rows, so it names many labels. Title pages, tables of contents
+    and examination regulations name few of them.
+
+    `min_labels`: Number of different labels a page must name to count as a module description page.
+    """
+
+    def __init__(self, min_labels:int=5):
+        self.min_labels = min_labels
+
+    def count_labels(self, page_text:str) -> int:
+        return sum(1 for pattern in label_patterns.values() if pattern.search(page_text))
+
+    def is_module_page(self, page_text:str) -> bool:
+        return self.count_labels(page_text) >= self.min_labels
+
+    def find_module_pages(self, page_texts:list) -> list:
+
+        """
+        Returns the indices of the pages from the first to the last module description page.
+
+        Pages in between are kept even if they name few labels, because long descriptions continue on the next page.
+        Returns all pages if no module description page is found.
+        """
+
+        module_page_indices = [index for index, page_text in enumerate(page_texts) if self.is_module_page(page_text)]
+        if not module_page_indices:
+            return list(range(len(page_texts)))
+
+        return list(range(module_page_indices[0], module_page_indices[-1] + 1))
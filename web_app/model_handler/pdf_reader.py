@@ -0,0 +1,133 @@
+# This module reads the text of PDF pages, in parallel worker processes for large documents.
+# It only depends on pymupdf, so worker processes start without importing torch.
+
+import os
+import tempfile
+import threading
+import multiprocessing
+from typing import Callable
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+
+# Documents with fewer pages per worker are read in the calling process
+MIN_PAGES_PER_WORKER = 16
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def get_page_text(page) -> str:
+
+    """
+    Returns the text of a page as a single line with normalized white space.
+    """
+
+    text = page.get_text().replace("\n", " ")
+    return " ".join(text.split())
+
+def get_page_lines(page) -> list:
+
+    """
+    Returns the non-empty lines of a page with normalized white space. Joined with spaces, they give `get_page_text`.
+    """
+
+    lines = [" ".join(line.split()) for line in page.get_text().split("\n")]
+    return [line for line in lines if line]
+
+def _extract_page_range(pdf_path:str, start:int, stop:int, get_page:Callable) -> list:
+
+    # Runs in a worker process. Every worker opens the document from the shared temporary file.
+    pdf_doc = pymupdf.open(pdf_path)
+    page_texts = [get_page(pdf_doc[page_index]) for page_index in range(start, stop)]
+    pdf_doc.close()
+
+    return page_texts
+
+def get_default_max_workers() -> int:
+
+    """
+    Returns the default number of worker processes: half of the CPU cores, at most 4.
+    """
+
+    return min(max((os.cpu_count() or 1) // 2, 1), 4)
+
+def _submit_page_ranges(pdf_path:str, page_ranges:list, get_page:Callable) -> list:
+
+    # The worker processes are started once and reused for every document, only the number of submitted page ranges
+    # depends on the document. The pool is only replaced if more ranges are requested than it has workers.
+    # The lock keeps other threads from submitting to a pool which is being replaced.
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < len(page_ranges):
+            if _pool is not None:
+                # Page ranges which were already submitted still finish
+                _pool.shutdown(wait=False)
+            _pool_workers = max(len(page_ranges), get_default_max_workers())
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=multiprocessing.get_context("spawn"))
+
+        return [_pool.submit(_extract_page_range, pdf_path, start, stop, get_page) for start, stop in page_ranges]
+
+def get_num_workers(num_pages:int, max_workers:int=None) -> int:
+
+    """
+    Returns the number of worker processes worth using for `num_pages` pages.
+
+    `max_workers`: Upper limit. `None` uses `get_default_max_workers`.
+    """
+
+    if max_workers is None:
+        max_workers = get_default_max_workers()
+
+    return max(min(max_workers, num_pages // MIN_PAGES_PER_WORKER), 1)
+
+def extract_page_texts(file_bytes:bytes, first_page_index:int=0, max_workers:int=None, as_lines:bool=False) -> list:
+
+    """
+    Returns the texts of all pages from `first_page_index` (0-based) to the end of the PDF document in `file_bytes`.
+
+    `as_lines`: Return the list of lines of every page (see `get_page_lines`) instead of its text.
+    """
+
+    return map_pages(file_bytes, get_page_lines if as_lines else get_page_text, first_page_index, None, max_workers)
+
+def map_pages(file_bytes:bytes, get_page:Callable, first_page_index:int=0, stop_page_index:int=None, max_workers:int=None) -> list:
+
+    """
+    Returns `get_page(page)` for the pages from `first_page_index` up to `stop_page_index` (0-based, `None` reads to the end)
+    of the PDF document in `file_bytes`.
+
+    `get_page` must be a module-level function, so it can be passed to the worker processes.
+
+    Large documents are split into page ranges which are read by parallel worker processes.
+    The workers open the document from one temporary file instead of receiving a copy of the bytes.
+    """
+
+    pdf_doc = pymupdf.open(stream=file_bytes, filetype="pdf")
+    first_page_index = max(first_page_index, 0)
+    page_indices = range(first_page_index, len(pdf_doc) if stop_page_index is None else min(stop_page_index, len(pdf_doc)))
+    num_workers = get_num_workers(len(page_indices), max_workers)
+
+    if num_workers == 1:
+        page_texts = [get_page(pdf_doc[page_index]) for page_index in page_indices]
+        pdf_doc.close()
+        return page_texts
+
+    pdf_doc.close()
+
+    # Contiguous page ranges, one per worker
+    range_size = -(-len(page_indices) // num_workers)
+    page_ranges = [(start, min(start + range_size, page_indices.stop)) for start in range(page_indices.start, page_indices.stop, range_size)]
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+        pdf_file.write(file_bytes)
+        pdf_path = pdf_file.name
+
+    try:
+        futures = _submit_page_ranges(pdf_path, page_ranges, get_page)
+        page_texts = []
+        for future in futures:
+            page_texts.extend(future.result())
+    finally:
+        os.remove(pdf_path)
+
+    return page_texts
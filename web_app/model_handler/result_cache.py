@@ -0,0 +1,146 @@
+# Persistent on-disk cache of extraction results.
+# Results are keyed by the content of the PDF, the module start page and the identity of the model.
+
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+
+class ResultCache:
+
+    """
+    Content-addressed cache of extracted files with size-bounded LRU eviction.
+
+    Entries are stored as `<cache_dir>/<model name>-<hash of the model folder path>/<model fingerprint>/<key>.json`.
+    When the model in a folder changes, its fingerprint changes and the entries of the old fingerprint are deleted.
+
+    `cache_dir`: Folder for the cache files.
+
+    `max_size_mb`: Size limit of the cache. The least recently used entries are removed first.
+
+    The lock only guards the threads of one process. Several server processes started from the same folder share
+    `cache_dir`, so entries are replaced atomically and files deleted by another process are skipped.
+    """
+
+    def __init__(self, cache_dir:str="./.cache/extractions", max_size_mb:int=256):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+
+    def make_key(self, file_bytes:bytes, module_start_page:int, model_identity:dict) -> tuple:
+
+        """
+        Returns the cache key for a PDF file.
+
+        `model_identity`: Dictionary with `model_dir`, `fingerprint` and `variant` of the model (see `ModelInteractor.get_model_identity`).
+        """
+
+        pdf_hash = hashlib.sha256(file_bytes).hexdigest()
+        entry_hash = hashlib.sha256(f"{pdf_hash}:{module_start_page}:{model_identity['variant']}".encode("utf-8")).hexdigest()
+        # Model folders with the same name (e.g. runs/a/model and runs/b/model) must not share the entries of their versions
+        model_path = os.path.abspath(model_identity["model_dir"])
+        model_name = f"{os.path.basename(model_path)}-{hashlib.sha256(model_path.encode('utf-8')).hexdigest()[:16]}"
+
+        return (model_name, model_identity["fingerprint"], entry_hash)
+
+    def _entry_path(self, key:tuple) -> str:
+        return os.path.join(self.cache_dir, key[0], key[1], f"{key[2]}.json")
+
+    def _drop_stale_versions(self, key:tuple) -> None:
+
+        # Delete the entries of older versions of the same model folder
+        model_cache_dir = os.path.join(self.cache_dir, key[0])
+        if not os.path.isdir(model_cache_dir):
+            return
+
+        for fingerprint in os.listdir(model_cache_dir):
+            if fingerprint != key[1]:
+                shutil.rmtree(os.path.join(model_cache_dir, fingerprint), ignore_errors=True)
+
+    def get(self, key:tuple) -> dict | None:
+
+        """
+        Returns the cached extracted file for `key` or `None`.
+        """
+
+        entry_path = self._entry_path(key)
+        with self._lock:
+            self._drop_stale_versions(key)
+
+            if not os.path.isfile(entry_path):
+                return None
+
+            try:
+                with open(entry_path, "r", encoding="utf-8") as entry_file:
+                    extracted_file = json.load(entry_file)
+            except (OSError, json.JSONDecodeError):
+                return None
+
+            # Mark the entry as recently used. Another process may have evicted it in the meantime.
+            try:
+                os.utime(entry_path)
+            except FileNotFoundError:
+                pass
+
+        return extracted_file
+
+    def put(self, key:tuple, extracted_file:dict) -> None:
+
+        """
+        Stores an extracted file under `key` and evicts the least recently used entries if the cache is too big.
+        """
+
+        entry_path = self._entry_path(key)
+        with self._lock:
+            self._drop_stale_versions(key)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+            # Write to a temporary file of this writer first, so readers never see half-written entries
+            temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix=".tmp")
+            try:
+                with os.fdopen(temp_fd, "w", encoding="utf-8") as entry_file:
+                    json.dump(extracted_file, entry_file, ensure_ascii=False)
+                os.replace(temp_path, entry_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            self._evict()
+
+    def _evict(self) -> None:
+
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith(".json"):
+                    try:
+                        stat = os.stat(os.path.join(root, file_name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file_name)))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            # Entries which another process removed already count as evicted
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self) -> None:
+
+        """
+        Deletes all cached results.
+        """
+
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+# The cache shared by the whole server process
+result_cache = ResultCache()
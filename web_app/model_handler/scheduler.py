@@ -0,0 +1,237 @@
+# Process-wide inference scheduler shared by all Streamlit sessions.
+# A single worker thread runs every forward pass, so concurrent sessions no longer oversubscribe the CPU
+# with their own PyTorch thread pools. Chunks of different sessions are merged into shared batches.
+
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import torch
+from .inferencing import _is_out_of_memory, get_labels_and_confidences
+
+class InferenceScheduler:
+
+    """
+    Collects chunks from all sessions and runs them in shared, dynamically formed batches.
+
+    Sessions are served round-robin, one chunk per session in turn, so a large handbook does not block a small one.
+
+    `max_batch_size`: Maximum number of chunks per forward pass.
+
+    `max_batch_tokens`: Optional limit on the number of (padded) tokens per forward pass.
+
+    `max_wait_ms`: How long the scheduler waits for more chunks before it runs a batch which is not full.
+    """
+
+    def __init__(self, max_batch_size:int=8, max_batch_tokens:int=None, max_wait_ms:float=20):
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+
+        self._queues = OrderedDict()
+        self._depth = 0
+        self._condition = threading.Condition()
+        self._worker = None
+
+        self.batches_run = 0
+        self.chunks_run = 0
+
+    def _start(self) -> None:
+
+        # The worker thread is started with the first submitted chunk
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._work, name="inference-scheduler", daemon=True)
+            self._worker.start()
+
+    def submit(self, session_id:str, runner, tokenizer, device, input_ids:list) -> list:
+
+        """
+        Queues the chunks of one request (token IDs with special tokens) for `runner`.
+
+        Returns one future per chunk. Each future resolves to `(predictions, confidences)`, the CPU tensors
+        of the content tokens of the chunk (without [CLS] and [SEP]).
+        """
+
+        # An empty queue in `_queues` would stop the worker (e.g. when the page cache answers every chunk)
+        futures = []
+        if not input_ids:
+            return futures
+
+        with self._condition:
+            queue = self._queues.setdefault(session_id, deque())
+            for chunk in input_ids:
+                request = {}
+                request["input_ids"] = chunk
+                request["runner"] = runner
+                request["pad_token_id"] = tokenizer.pad_token_id
+                request["device"] = device
+                request["future"] = Future()
+
+                queue.append(request)
+                futures.append(request["future"])
+
+            self._depth += len(input_ids)
+            self._start()
+            self._condition.notify()
+
+        return futures
+
+    def queue_depth(self, session_id:str=None) -> int:
+
+        """
+        Returns the number of chunks waiting for the model, of one session or of all sessions.
+        """
+
+        with self._condition:
+            if session_id is None:
+                return self._depth
+            return len(self._queues.get(session_id, ()))
+
+    def stats(self) -> dict:
+        with self._condition:
+            stats = {}
+            stats["queue_depth"] = self._depth
+            stats["waiting_sessions"] = len(self._queues)
+            stats["batches_run"] = self.batches_run
+            stats["chunks_run"] = self.chunks_run
+            stats["avg_batch_size"] = self.chunks_run / self.batches_run if self.batches_run else 0.0
+
+        return stats
+
+    def _pop_request(self, session_id:str) -> None:
+
+        queue = self._queues[session_id]
+        queue.popleft()
+        self._depth -= 1
+
+        # The session goes to the back of the line
+        if queue:
+            self._queues.move_to_end(session_id)
+        else:
+            del self._queues[session_id]
+
+    def _take_batch(self, batch:list) -> list:
+
+        # Take one chunk per session in turn into `batch`. All chunks of a batch must be for the same model.
+        runner = None
+        longest = 0
+
+        while len(batch) < self.max_batch_size:
+            taken = False
+            for session_id in list(self._queues):
+                if len(batch) >= self.max_batch_size:
+                    break
+
+                queue = self._queues[session_id]
+                request = queue[0]
+
+                # Chunks of cancelled requests are dropped
+                if request["future"].cancelled():
+                    self._pop_request(session_id)
+                    taken = True
+                    continue
+
+                if runner is not None and request["runner"] is not runner:
+                    continue
+
+                padded_length = max(longest, len(request["input_ids"]))
+                if batch and self.max_batch_tokens is not None and padded_length * (len(batch) + 1) > self.max_batch_tokens:
+                    return batch
+
+                self._pop_request(session_id)
+                taken = True
+                if not request["future"].set_running_or_notify_cancel():
+                    continue
+
+                batch.append(request)
+                runner = request["runner"]
+                longest = padded_length
+
+            if not taken:
+                break
+
+        return batch
+
+    def _fail_outstanding(self, batch:list, error:Exception) -> None:
+
+        # Fail the chunks of the current batch and all queued chunks, so no session waits for them forever
+        with self._condition:
+            requests = batch + [request for queue in self._queues.values() for request in queue]
+            self._queues.clear()
+            self._depth = 0
+
+        for request in requests:
+            if not request["future"].done():
+                request["future"].set_exception(error)
+
+    def _work(self) -> None:
+
+        while True:
+            batch = []
+            try:
+                with self._condition:
+                    while self._depth == 0:
+                        self._condition.wait()
+
+                    # Give other sessions a moment to add chunks to a batch which is not full yet
+                    deadline = time.monotonic() + self.max_wait
+                    while self._depth < self.max_batch_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+
+                    self._take_batch(batch)
+
+                if batch:
+                    self._run_batch(batch)
+            except Exception as error:
+                # The worker keeps running for the requests submitted later
+                print(f"----- INFERENCE SCHEDULER FAILED: {error!r} -----")
+                self._fail_outstanding(batch, error)
+
+    def _run_batch(self, batch:list) -> None:
+
+        runner = batch[0]["runner"]
+        device = batch[0]["device"]
+        pad_token_id = batch[0]["pad_token_id"]
+
+        # Pad only up to the longest chunk of this batch
+        max_length = max(len(request["input_ids"]) for request in batch)
+        input_ids = [request["input_ids"] + [pad_token_id] * (max_length - len(request["input_ids"])) for request in batch]
+        attention_mask = [[1] * len(request["input_ids"]) + [0] * (max_length - len(request["input_ids"])) for request in batch]
+
+        try:
+            with torch.no_grad():
+                logits = runner(torch.tensor(input_ids).to(device), torch.tensor(attention_mask).to(device))
+        except RuntimeError as error:
+            # Run both halves on their own if the batch does not fit into memory
+            if len(batch) > 1 and _is_out_of_memory(error):
+                print(f"----- OUT OF MEMORY. SPLITTING SCHEDULED BATCH OF {len(batch)} -----")
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                self._run_batch(batch[:len(batch) // 2])
+                self._run_batch(batch[len(batch) // 2:])
+                return
+            for request in batch:
+                request["future"].set_exception(error)
+            return
+        except Exception as error:
+            for request in batch:
+                request["future"].set_exception(error)
+            return
+
+        # Label and confidence (max. softmax probability) of every token, moved to the host in one transfer
+        predictions, confidence_scores = get_labels_and_confidences(logits)
+        predictions = predictions.cpu()
+        confidence_scores = confidence_scores.cpu()
+
+        for row, request in enumerate(batch):
+            content_end = len(request["input_ids"]) - 1
+            request["future"].set_result((predictions[row, 1:content_end], confidence_scores[row, 1:content_end]))
+
+        self.batches_run += 1
+        self.chunks_run += len(batch)
+
+# The scheduler shared by all sessions of the server process
+inference_scheduler = InferenceScheduler()